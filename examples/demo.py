@@ -7,7 +7,6 @@ Run after installing the package:
 """
 from pprint import pprint
 
-import numpy as np
 import pandas as pd
 
 from pandas_formula import FormulaEngine
@@ -37,16 +36,6 @@ def demo_common():
     engine = FormulaEngine()
 
     # Register custom functions
-    engine.register(
-        "grade",
-        lambda s: np.where(
-            s >= 90,
-            "A",
-            np.where(s >= 80, "B", np.where(s >= 70, "C", np.where(s >= 60, "D", "F"))),
-        ),
-        "Convert score to letter grade",
-    )
-
     engine.register(
         "full_name",
         lambda first, last: first.str.cat(last, sep=" "),
@@ -69,8 +58,9 @@ def demo_common():
         "margin": "@profit_margin(price_clean, quantity, cost)",
         # Conditional
         "status": "@if_else(@gt(score, 70), 'pass', 'fail')",
-        # Custom grade function
-        "grade": "@grade(score)",
+        # Binning into a categorical column
+        "grade": "@categorize(score, [-inf, 60, 70, 80, 90, inf], "
+        "['F', 'D', 'C', 'B', 'A'], right=False)",
         # String operations
         "name": "@full_name(first_name, last_name)",
         "name_upper": "@upper(name)",
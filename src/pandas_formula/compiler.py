@@ -0,0 +1,590 @@
+"""
+Formula compiler - turns formula strings into cached code objects.
+"""
+
+from __future__ import annotations
+
+import ast
+import copy
+import functools
+import inspect
+import keyword
+import operator
+import re
+from collections import Counter
+from functools import lru_cache
+from types import CodeType
+from typing import Callable
+
+import numpy as np
+
+try:
+    import numexpr
+except ImportError:  # pragma: no cover - optional dependency
+    numexpr = None
+
+# One pass over the source: string literals are matched (and skipped) first so
+# that an '@' or '`' inside a literal is never mistaken for a function call or
+# a quoted column name.
+_SOURCE_PATTERN = re.compile(
+    r"""(?P<str>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")|@(?P<func>\w+)|`(?P<col>[^`]*)`"""
+)
+
+# Prefix for registry names inside compiled formulas, so that @name never
+# collides with a column of the same name.
+FUNC_PREFIX = "__pf_"
+
+# Prefix for `quoted` column names that are not valid identifiers (see identifier)
+_COLUMN_PREFIX = "__col_"
+
+# Global bound to isin() in compiled code (`in` / `not in` comparisons)
+ISIN = "__isin"
+
+# Names pandas.eval resolves by default, e.g. @gt(a, inf)
+_DEFAULT_SCOPE: dict[str, float] = {"inf": float("inf"), "Inf": float("inf")}
+
+# Math functions pandas.eval accepts as bare calls, e.g. sqrt(abs(a))
+MATH_FUNCTIONS: dict[str, Callable] = {
+    name: getattr(np, name)
+    for name in (
+        "sin", "cos", "tan", "exp", "log", "expm1", "log1p", "sqrt", "sinh",
+        "cosh", "tanh", "arcsin", "arccos", "arctan", "arccosh", "arcsinh",
+        "arctanh", "abs", "log10", "floor", "ceil", "arctan2",
+    )
+}
+
+# Names for common-subexpression temporaries (see eliminate_common_subexpressions)
+_CSE_PREFIX = "__cse"
+
+# Global bound to select() in compiled code (see fuse_conditionals)
+FUSED_SELECT = "__select"
+
+# numexpr only pays off once its per-call setup is amortized over enough rows.
+NUMEXPR_MIN_ROWS = 10_000
+
+# Column dtypes numexpr evaluates with NumPy's result dtypes (see is_numexpr_dtype)
+_NUMEXPR_DTYPES = (np.dtype(np.int64), np.dtype(np.float64))
+
+# Registered callables that map one-to-one onto a numexpr operator.
+_BINARY_OPERATORS: dict[Callable, type[ast.operator]] = {
+    operator.add: ast.Add,
+    operator.sub: ast.Sub,
+    operator.mul: ast.Mult,
+    operator.truediv: ast.Div,
+    operator.pow: ast.Pow,
+    operator.and_: ast.BitAnd,
+    operator.or_: ast.BitOr,
+}
+_COMPARE_OPERATORS: dict[Callable, type[ast.cmpop]] = {
+    operator.eq: ast.Eq,
+    operator.ne: ast.NotEq,
+    operator.gt: ast.Gt,
+    operator.ge: ast.GtE,
+    operator.lt: ast.Lt,
+    operator.le: ast.LtE,
+}
+_UNARY_OPERATORS: dict[Callable, type[ast.unaryop]] = {
+    operator.neg: ast.USub,
+    operator.invert: ast.Invert,
+}
+
+_PURE_OPERATORS = (
+    set(_BINARY_OPERATORS)
+    | set(_COMPARE_OPERATORS)
+    | set(_UNARY_OPERATORS)
+    | {operator.floordiv, operator.mod}
+)
+
+# Nodes whose children are always evaluated, left to right in field order.
+# Anything else (IfExp, BoolOp, comprehensions, ...) may skip or reorder
+# evaluation, so common-subexpression elimination never looks inside it.
+_CSE_LEAVES = (
+    ast.Name,
+    ast.Constant,
+    ast.expr_context,
+    ast.operator,
+    ast.unaryop,
+    ast.cmpop,
+)
+_CSE_OPERATIONS = (ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call)
+_CSE_BRANCHES = (ast.Expression, ast.List, ast.Tuple, ast.keyword, *_CSE_OPERATIONS)
+
+_NUMEXPR_NODES = (
+    ast.Expression,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.Compare,
+    ast.Name,
+    ast.Constant,
+    ast.Load,
+    ast.operator,
+    ast.unaryop,
+    ast.cmpop,
+)
+
+
+@lru_cache(maxsize=1024)
+def parse_formula(formula: str) -> ast.Expression:
+    """Parse a formula string into an expression tree.
+
+    @name calls are rewritten to prefixed identifiers (see FUNC_PREFIX) and
+    `quoted` column names to identifiers (see identifier). The pandas.eval
+    operators that Python would apply to a whole column are made elementwise
+    (see _ElementwiseRewriter). The returned tree is shared by the cache and
+    must not be mutated.
+
+    Raises:
+        SyntaxError: If the formula is not a valid expression
+    """
+    source = _SOURCE_PATTERN.sub(_mangle, formula)
+    tree = ast.parse(source.strip(), "<formula>", "eval")
+    return ast.fix_missing_locations(_ElementwiseRewriter().visit(tree))
+
+
+def _mangle(match: re.Match) -> str:
+    """Prefix an @function match, turn a `quoted` name into an identifier and
+    leave string literals untouched."""
+    if match.group("func") is not None:
+        return FUNC_PREFIX + match.group("func")
+    if match.group("col") is not None:
+        return identifier(match.group("col"))
+    return match.group()
+
+
+def identifier(column: str) -> str:
+    """Return the identifier a column is bound to in compiled formulas.
+
+    Column names that are valid identifiers are used as they are; any other
+    name (e.g. 'my col', written `my col` in a formula) is hex-encoded
+    behind _COLUMN_PREFIX.
+    """
+    if column.isidentifier() and not keyword.iskeyword(column):
+        return column
+    return _COLUMN_PREFIX + column.encode().hex()
+
+
+def _column(name: str) -> str:
+    """Map an identifier from a compiled formula back to its column name."""
+    if name.startswith(_COLUMN_PREFIX):
+        return bytes.fromhex(name[len(_COLUMN_PREFIX):]).decode()
+    return name
+
+
+class _ElementwiseRewriter(ast.NodeTransformer):
+    """Give boolean operators pandas.eval's elementwise meaning.
+
+    and/or/not become &/|/~, a chained comparison 1 < a < 3 becomes
+    (1 < a) & (a < 3) and `in`/`not in` become isin() calls, so they work on
+    whole columns instead of asking a Series for its truth value. Names from
+    pandas.eval's default scope (see _DEFAULT_SCOPE) become constants, so they
+    are never mistaken for columns.
+    """
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        if node.id in _DEFAULT_SCOPE:
+            return ast.Constant(_DEFAULT_SCOPE[node.id])
+        return node
+
+    def visit_BoolOp(self, node: ast.BoolOp) -> ast.AST:
+        self.generic_visit(node)
+        op = ast.BitAnd if isinstance(node.op, ast.And) else ast.BitOr
+        return functools.reduce(
+            lambda left, right: ast.BinOp(left, op(), right), node.values
+        )
+
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> ast.AST:
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Not):
+            return ast.UnaryOp(ast.Invert(), node.operand)
+        return node
+
+    def visit_Compare(self, node: ast.Compare) -> ast.AST:
+        self.generic_visit(node)
+        if len(node.ops) == 1 and not isinstance(node.ops[0], (ast.In, ast.NotIn)):
+            return node
+        parts = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            if isinstance(op, (ast.In, ast.NotIn)):
+                part = ast.Call(ast.Name(ISIN, ast.Load()), [left, right], [])
+                if isinstance(op, ast.NotIn):
+                    part = ast.UnaryOp(ast.Invert(), part)
+            else:
+                part = ast.Compare(left, [op], [right])
+            parts.append(part)
+            left = copy.deepcopy(right)
+        return functools.reduce(
+            lambda left, right: ast.BinOp(left, ast.BitAnd(), right), parts
+        )
+
+
+def isin(values, candidates):
+    """Elementwise membership test, as `values in candidates` in pandas.eval."""
+    if np.ndim(candidates) == 0:
+        candidates = [candidates]
+    if hasattr(values, "isin"):
+        return values.isin(candidates)
+    if np.ndim(values):
+        return np.isin(values, candidates)
+    return values in candidates
+
+
+@lru_cache(maxsize=1024)
+def compile_formula(formula: str) -> tuple[CodeType, frozenset[str]]:
+    """Compile a formula string once into a reusable code object.
+
+    Args:
+        formula: Formula string (e.g. '@add(a, b)')
+
+    Returns:
+        Tuple of (code object, names of the @functions it calls)
+    """
+    tree = parse_formula(formula)
+    func_names = frozenset(
+        node.id[len(FUNC_PREFIX):]
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and node.id.startswith(FUNC_PREFIX)
+    )
+    return compile(tree, "<formula>", "eval"), func_names
+
+
+@lru_cache(maxsize=1024)
+def literal(formula: str) -> tuple[object] | None:
+    """Recognize formulas that are a single scalar literal (e.g. '3.14').
+
+    Returns:
+        One-element tuple holding the value, or None if the formula is not a
+        scalar literal (containers are excluded since the cached value would
+        be shared between calls)
+    """
+    try:
+        value = ast.literal_eval(formula.strip())
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return None
+    if isinstance(value, (list, tuple, dict, set)):
+        return None
+    return (value,)
+
+
+@lru_cache(maxsize=1024)
+def uses_attributes(formula: str) -> bool:
+    """Check whether a formula reads attributes, e.g. price.fillna(0).
+
+    Such formulas call Series methods, so their columns must stay Series.
+    """
+    tree = parse_formula(formula)
+    return any(isinstance(node, ast.Attribute) for node in ast.walk(tree))
+
+
+@lru_cache(maxsize=4096)
+def referenced_names(formula: str) -> frozenset[str]:
+    """Collect the column names a formula reads, in a single tree walk.
+
+    Call targets (@functions) and keyword argument names are excluded
+    structurally; string and numeric literals are never names.
+
+    Raises:
+        SyntaxError: If the formula is not a valid expression
+    """
+    names = set()
+    callees = set()
+    for node in ast.walk(parse_formula(formula)):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            callees.add(node.func.id)
+        elif isinstance(node, ast.Name) and not node.id.startswith(FUNC_PREFIX):
+            names.add(node.id)
+    return frozenset(map(_column, names - callees))
+
+
+class _OperatorExpander(ast.NodeTransformer):
+    """Rewrite calls to operator-backed functions into operator syntax."""
+
+    def __init__(self, resolve: Callable[[str], Callable | None]):
+        self._resolve = resolve
+
+    def visit_Call(self, node: ast.Call) -> ast.AST:
+        self.generic_visit(node)
+        if not isinstance(node.func, ast.Name) or node.keywords:
+            return node
+        if not node.func.id.startswith(FUNC_PREFIX):
+            return node
+
+        # Accelerated wrappers (see functions._numba_kernels) unwrap to the operator
+        func = inspect.unwrap(self._resolve(node.func.id[len(FUNC_PREFIX):]))
+        args = node.args
+        if len(args) == 2 and func in _BINARY_OPERATORS:
+            return ast.BinOp(args[0], _BINARY_OPERATORS[func](), args[1])
+        if len(args) == 2 and func in _COMPARE_OPERATORS:
+            return ast.Compare(args[0], [_COMPARE_OPERATORS[func]()], [args[1]])
+        if len(args) == 1 and func in _UNARY_OPERATORS:
+            return ast.UnaryOp(_UNARY_OPERATORS[func](), args[0])
+        return node
+
+
+def to_numexpr(
+    formula: str, resolve: Callable[[str], Callable | None]
+) -> str | None:
+    """Expand a formula into a plain numexpr expression, if possible.
+
+    Args:
+        formula: Formula string (e.g. '@mul(@add(a, b), c)')
+        resolve: Maps a function name to its registered callable (or None)
+
+    Returns:
+        Expression string (e.g. '(a + b) * c'), or None if the formula calls
+        anything that is not a pure arithmetic/comparison/logical operator
+    """
+    tree = _OperatorExpander(resolve).visit(copy.deepcopy(parse_formula(formula)))
+    for node in ast.walk(tree):
+        if not isinstance(node, _NUMEXPR_NODES):
+            return None
+        if isinstance(node, ast.Name) and node.id.startswith(FUNC_PREFIX):
+            return None
+        if isinstance(node, ast.Constant) and not isinstance(
+            node.value, (int, float)
+        ):
+            return None
+        if isinstance(node, ast.Compare) and len(node.ops) != 1:
+            return None
+    return ast.unparse(tree)
+
+
+class _NameInliner(ast.NodeTransformer):
+    """Replace names with the expression trees they stand for."""
+
+    def __init__(self, substitutions: dict[str, ast.expr]):
+        self._substitutions = substitutions
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        if node.id in self._substitutions:
+            return copy.deepcopy(self._substitutions[node.id])
+        return node
+
+
+def inline(expression: str, substitutions: dict[str, str]) -> str:
+    """Substitute named sub-expressions into a formula or expression.
+
+    Args:
+        expression: Formula or expression string (e.g. '@add(step1, b)')
+        substitutions: Dict of name -> formula or expression
+            (e.g. {'step1': '@mul(a, 2)'})
+
+    Returns:
+        Fused string, with @name calls in their compiled form
+        (e.g. '__pf_add(__pf_mul(a, 2), b)')
+    """
+    trees = {
+        identifier(name): parse_formula(sub).body
+        for name, sub in substitutions.items()
+    }
+    tree = _NameInliner(trees).visit(copy.deepcopy(parse_formula(expression)))
+    return ast.unparse(tree)
+
+
+def is_pure(func: Callable | None) -> bool:
+    """Check whether a registered callable is a side-effect-free operator."""
+    return inspect.unwrap(func) in _PURE_OPERATORS if func is not None else False
+
+
+def eliminate_common_subexpressions(
+    tree: ast.Expression, is_pure_function: Callable[[str], bool]
+) -> ast.Expression | None:
+    """Compute repeated pure sub-expressions of a formula only once.
+
+    The first occurrence (in evaluation order) is bound to a temporary with an
+    assignment expression and later occurrences read the temporary, e.g.
+    @div(@sub(@mul(p, q), c), @mul(p, q)) becomes
+    div(sub((t := mul(p, q)), c), t).
+
+    Run it after fuse_conditionals: select() evaluates all conditions before
+    any choice, so temporaries must be bound in that evaluation order.
+
+    Args:
+        tree: Expression tree (left untouched)
+        is_pure_function: Whether an @function name is free of side effects
+
+    Returns:
+        Rewritten tree, or None if nothing is repeated
+    """
+    keys: dict[int, str] = {}
+
+    def classify(node: ast.AST) -> bool:
+        """Record structural keys of pure operations; return node purity."""
+        if isinstance(node, _CSE_LEAVES):
+            return True
+        if not isinstance(node, _CSE_BRANCHES):
+            return False
+        pure = all([classify(child) for child in ast.iter_child_nodes(node)])
+        if isinstance(node, ast.Call):
+            pure = (
+                pure
+                and isinstance(node.func, ast.Name)
+                and node.func.id.startswith(FUNC_PREFIX)
+                and is_pure_function(node.func.id[len(FUNC_PREFIX):])
+            )
+        if pure and isinstance(node, _CSE_OPERATIONS):
+            keys[id(node)] = ast.dump(node)
+        return pure
+
+    classify(tree)
+    repeated = {key for key, n in Counter(keys.values()).items() if n > 1}
+    if not repeated:
+        return None
+
+    # Inner repeats of a repeated sub-expression only count within its first
+    # occurrence, since later occurrences are replaced wholesale.
+    counts: Counter[str] = Counter()
+
+    def count(node: ast.AST) -> None:
+        key = keys.get(id(node))
+        if key in repeated:
+            counts[key] += 1
+            if counts[key] > 1:
+                return
+        if isinstance(node, _CSE_BRANCHES):
+            for child in ast.iter_child_nodes(node):
+                count(child)
+
+    count(tree)
+    shared = {key for key, n in counts.items() if n > 1}
+    temporaries: dict[str, str] = {}
+
+    def rewrite(node: ast.AST) -> ast.AST:
+        key = keys.get(id(node))
+        if key in shared and key in temporaries:
+            return ast.Name(temporaries[key], ast.Load())
+        if not isinstance(node, _CSE_BRANCHES):
+            return node
+
+        new = copy.copy(node)
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                value = [rewrite(v) if isinstance(v, ast.AST) else v for v in value]
+            elif isinstance(value, ast.AST):
+                value = rewrite(value)
+            setattr(new, field, value)
+
+        if key in shared:
+            temporaries[key] = f"{_CSE_PREFIX}{len(temporaries)}"
+            return ast.NamedExpr(ast.Name(temporaries[key], ast.Store()), new)
+        return new
+
+    return ast.fix_missing_locations(rewrite(tree))
+
+
+def is_where(func: Callable | None) -> bool:
+    """Check whether a registered callable is np.where (e.g. @if_else)."""
+    return func is not None and inspect.unwrap(func) is inspect.unwrap(np.where)
+
+
+def select(condlist: list, choicelist: list, default):
+    """np.select with np.where's truthiness rules for the conditions."""
+    conditions = [np.asarray(c).astype(bool, copy=False) for c in condlist]
+    return np.select(conditions, choicelist, default)
+
+
+class _ConditionalFuser(ast.NodeTransformer):
+    """Rewrite chains of nested np.where calls into a single select()."""
+
+    def __init__(self, is_where_function: Callable[[str], bool]):
+        self._is_where = is_where_function
+        self.fused = False
+
+    def _where_args(self, node: ast.AST) -> list[ast.expr] | None:
+        if not isinstance(node, ast.Call) or node.keywords or len(node.args) != 3:
+            return None
+        func = node.func
+        if not isinstance(func, ast.Name) or not func.id.startswith(FUNC_PREFIX):
+            return None
+        return node.args if self._is_where(func.id[len(FUNC_PREFIX):]) else None
+
+    def visit_Call(self, node: ast.Call) -> ast.AST:
+        conditions, choices = [], []
+        default = node
+        while (args := self._where_args(default)) is not None:
+            conditions.append(args[0])
+            choices.append(args[1])
+            default = args[2]
+        if len(conditions) < 2:
+            return self.generic_visit(node)
+
+        self.fused = True
+        return ast.Call(
+            ast.Name(FUSED_SELECT, ast.Load()),
+            [
+                ast.List([self.visit(c) for c in conditions], ast.Load()),
+                ast.List([self.visit(c) for c in choices], ast.Load()),
+                self.visit(default),
+            ],
+            [],
+        )
+
+
+def fuse_conditionals(
+    tree: ast.Expression, is_where_function: Callable[[str], bool]
+) -> ast.Expression | None:
+    """Turn nested conditionals into one np.select over all branches.
+
+    @if_else(c1, 'A', @if_else(c2, 'B', 'F')) scans the data and allocates a
+    result once per level; select([c1, c2], ['A', 'B'], 'F') does it once.
+    Conditions and values are evaluated eagerly either way.
+
+    Args:
+        tree: Expression tree (left untouched)
+        is_where_function: Whether an @function name is np.where
+
+    Returns:
+        Rewritten tree calling FUSED_SELECT, or None if nothing is nested
+    """
+    fuser = _ConditionalFuser(is_where_function)
+    fused = fuser.visit(copy.deepcopy(tree))
+    return ast.fix_missing_locations(fused) if fuser.fused else None
+
+
+class _ConstantInliner(ast.NodeTransformer):
+    """Turn zero-argument calls of constants into plain name lookups."""
+
+    def __init__(self, constants: frozenset[str]):
+        self._constants = constants
+        self.inlined = False
+
+    def visit_Call(self, node: ast.Call) -> ast.AST:
+        self.generic_visit(node)
+        func = node.func
+        if node.args or node.keywords or not isinstance(func, ast.Name):
+            return node
+        if func.id[len(FUNC_PREFIX):] not in self._constants:
+            return node
+        self.inlined = True
+        return func
+
+
+def inline_constants(
+    tree: ast.Expression, constants: frozenset[str]
+) -> ast.Expression | None:
+    """Rewrite @name() for the given constant names into a bare @name.
+
+    The prefixed name is then bound to the constant value itself, so
+    referencing a constant no longer costs a function call.
+
+    Args:
+        tree: Expression tree (left untouched)
+        constants: Names of engine constants
+
+    Returns:
+        Rewritten tree, or None if no constant is called
+    """
+    inliner = _ConstantInliner(constants)
+    inlined = inliner.visit(copy.deepcopy(tree))
+    return ast.fix_missing_locations(inlined) if inliner.inlined else None
+
+
+def is_numexpr_dtype(dtype) -> bool:
+    """Check whether numexpr can evaluate a column of the given dtype.
+
+    Only int64 and float64 qualify: numexpr upcasts narrower types (e.g.
+    float32 * 0.1 gives float64, int8 + int8 gives int32), so with them the
+    result dtype would depend on whether the frame is large enough for
+    numexpr.
+    """
+    return dtype in _NUMEXPR_DTYPES
@@ -4,19 +4,19 @@ Formula Engine - Main engine for evaluating formulas on pandas DataFrames.
 
 from __future__ import annotations
 
-import re
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from types import CodeType
 from typing import Any, Callable
 
+import numpy as np
 import pandas as pd
 
-_FUNC_PATTERN = re.compile(r"@(\w+)")
-_KWARG_PATTERN = re.compile(r"\b(\w+)\s*=")
-_NUMERIC_PATTERN = re.compile(r"^-?\d+\.?\d*$")
-_SCI_NOTATION = re.compile(r"\d+\.?\d*e[+-]?\d+", re.IGNORECASE)
-_STRING_LITERAL = re.compile(r"""('[^']*'|"[^"]*")""")
-_IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][\w.\[\]]*")
-
+from . import compiler
+from .compiler import FUNC_PREFIX, compile_formula
 from .functions import FunctionRegistry, create_default_registry
+from .functions.string import conversion_cache
 
 
 class FormulaEngine:
@@ -32,11 +32,16 @@ class FormulaEngine:
         >>> result = engine.apply(df, {'total': '@mul(price, qty)'})
     """
 
-    def __init__(self, include_defaults: bool = True):
+    def __init__(self, include_defaults: bool = True, max_workers: int | None = 1):
         """Initialize the formula engine.
 
         Args:
             include_defaults: Whether to include default functions (default: True)
+            max_workers: Threads used to evaluate independent formulas
+                concurrently. NumPy and numexpr release the GIL, so formulas
+                over large columns scale across cores. None uses all CPUs;
+                1 evaluates serially (default: 1). Custom functions must be
+                thread-safe when this is not 1.
         """
         if include_defaults:
             self._registry = create_default_registry()
@@ -45,19 +50,31 @@ class FormulaEngine:
 
         self._constants: dict[str, Any] = {}
         self._formulas: dict[str, str] = {}
+        # formula -> (code, globals with its resolved functions, column refs,
+        # whether every function it calls accepts raw arrays)
+        self._compiled: dict[
+            str, tuple[CodeType, dict[str, Any], frozenset[str], bool]
+        ] = {}
+        # formula -> its numexpr expansion (see compiler.to_numexpr), or None
+        self._expanded: dict[str, str | None] = {}
+        self._compiled_version = self._registry.version
+        self._max_workers = max_workers or os.cpu_count() or 1
 
     @property
     def registry(self) -> FunctionRegistry:
         """Access the function registry."""
         return self._registry
 
-    def register(self, name: str, func: Callable, doc: str = "") -> "FormulaEngine":
+    def register(
+        self, name: str, func: Callable, doc: str = "", raw: bool = False
+    ) -> "FormulaEngine":
         """Register a custom function.
 
         Args:
             name: Function name (called as @name in formulas)
             func: Function implementation
             doc: Optional documentation
+            raw: Whether func works on plain NumPy arrays (default: False)
 
         Returns:
             self for method chaining
@@ -65,7 +82,7 @@ class FormulaEngine:
         Example:
             >>> engine.register('margin', lambda rev, cost: (rev - cost) / rev)
         """
-        self._registry.register(name, func, doc)
+        self._registry.register(name, func, doc, raw)
         return self
 
     def register_batch(
@@ -85,19 +102,15 @@ class FormulaEngine:
             ...     'discount': (lambda p, r: p * r, 'Apply discount'),
             ... })
         """
-        for name, entry in functions.items():
-            if isinstance(entry, tuple):
-                func, doc = entry
-            else:
-                func, doc = entry, ""
-            self._registry.register(name, func, doc)
+        self._registry.register_batch(functions)
         return self
 
     def add_constant(self, name: str, value: Any) -> "FormulaEngine":
         """Add a constant value.
 
-        Constants can be referenced in formulas but are not currently
-        supported with df.eval(). Use register() with a lambda instead.
+        Constants are referenced as @name (or @name()) in formulas, or by
+        their bare name when no column of that name exists. They take
+        precedence over a registered function of the same name.
 
         Args:
             name: Constant name
@@ -107,8 +120,8 @@ class FormulaEngine:
             self for method chaining
         """
         self._constants[name] = value
-        # Also register as a function that returns the constant
-        self._registry.register(name, lambda: value)
+        self._compiled.clear()
+        self._expanded.clear()
         return self
 
     def add_formula(self, column: str, formula: str) -> "FormulaEngine":
@@ -124,33 +137,295 @@ class FormulaEngine:
         self._formulas[column] = formula
         return self
 
-    def _eval_formula(self, df: pd.DataFrame, column: str, formula: str) -> None:
+    def _eval_formula(
+        self,
+        df: pd.DataFrame,
+        formula: str,
+        computed: dict[str, Any] | None = None,
+    ) -> Any:
         """Evaluate a single formula on a DataFrame.
 
         Args:
-            df: DataFrame to evaluate on (modified inplace)
-            column: Target column name
+            df: DataFrame providing column values
             formula: Formula string
+            computed: Columns computed so far in this apply(); these take
+                precedence over df columns of the same name
+
+        Returns:
+            Computed column values (Series, array or scalar)
 
         Raises:
             Exception: If formula evaluation fails
         """
-        df.eval(
-            f"{column} = {formula}",
-            local_dict=self._registry.as_dict(),
-            engine="python",
-            inplace=True,
-        )
+        computed = computed or {}
+
+        literal = compiler.literal(formula)
+        if literal is not None:
+            return literal[0]
+
+        expression = self._numexpr_expression(df, formula, computed)
+        if expression is not None:
+            local_dict = self._namespace(
+                df, computed, compiler.referenced_names(expression)
+            )
+            for name, value in local_dict.items():
+                local_dict[name] = np.asarray(value)
+            return compiler.numexpr.evaluate(expression, local_dict=local_dict)
+
+        code, globals_, refs, raw = self._bind(formula)
+        namespace = self._namespace(df, computed, refs)
+        if not raw:
+            return eval(code, globals_, namespace)
+
+        for name, value in namespace.items():
+            namespace[name] = self._to_raw(value)
+        # Match pandas, which silences divide-by-zero and invalid warnings
+        with np.errstate(all="ignore"):
+            return eval(code, globals_, namespace)
+
+    def _bind(
+        self, formula: str
+    ) -> tuple[CodeType, dict[str, Any], frozenset[str], bool]:
+        """Compile a formula and resolve its @functions, once per formula.
+
+        The result is reused by every later apply() until the registry
+        changes.
+
+        Returns:
+            Tuple of (code object, globals for eval, referenced column names,
+            whether all called functions accept raw arrays)
+        """
+        self._sync_registry()
+        bound = self._compiled.get(formula)
+        if bound is None:
+            code, func_names = compile_formula(formula)
+            constants = func_names & self._constants.keys()
+            tree = compiler.fuse_conditionals(
+                compiler.parse_formula(formula), self._is_where
+            )
+            tree = compiler.eliminate_common_subexpressions(
+                tree or compiler.parse_formula(formula), self._is_pure
+            ) or tree
+            if constants:
+                tree = compiler.inline_constants(
+                    tree or compiler.parse_formula(formula), frozenset(constants)
+                ) or tree
+            if tree is not None:
+                code = compile(tree, "<formula>", "eval")
+            globals_ = {
+                "__builtins__": {},
+                compiler.FUSED_SELECT: compiler.select,
+                compiler.ISIN: compiler.isin,
+                **compiler.MATH_FUNCTIONS,
+            }
+            for name in func_names:
+                if name in constants:
+                    globals_[FUNC_PREFIX + name] = self._constants[name]
+                else:
+                    globals_[FUNC_PREFIX + name] = self._registry.get(name)
+            # Formulas without @functions, or calling Series methods, work on
+            # pandas objects and must not see bare arrays
+            functions = func_names - constants
+            raw = (
+                bool(functions)
+                and all(self._registry.is_raw(name) for name in functions)
+                and not compiler.uses_attributes(formula)
+            )
+            bound = (code, globals_, compiler.referenced_names(formula), raw)
+            self._compiled[formula] = bound
+        return bound
+
+    def _sync_registry(self) -> None:
+        """Drop per-formula caches once the registry has changed."""
+        if self._compiled_version != self._registry.version:
+            self._compiled.clear()
+            self._expanded.clear()
+            self._compiled_version = self._registry.version
+
+    def _expand(self, formula: str) -> str | None:
+        """Expand a formula with compiler.to_numexpr, once per formula.
+
+        Like _bind, the result is reused until the registry changes.
+        """
+        self._sync_registry()
+        if formula not in self._expanded:
+            self._expanded[formula] = compiler.to_numexpr(
+                formula, self._resolve_function
+            )
+        return self._expanded[formula]
+
+    def _namespace(
+        self, df: pd.DataFrame, computed: dict[str, Any], names: frozenset[str]
+    ) -> dict[str, Any]:
+        """Collect the values of the given columns for evaluation.
+
+        Values are keyed by the identifier compiled formulas use for each
+        column (see compiler.identifier). Names that are not columns fall
+        back to constants; names found nowhere are left out, so evaluation
+        fails with a NameError for them.
+        """
+        namespace = {}
+        for name in names:
+            if name in computed:
+                namespace[compiler.identifier(name)] = computed[name]
+            elif name in df.columns:
+                namespace[compiler.identifier(name)] = df[name]
+            elif name in self._constants:
+                namespace[name] = self._constants[name]
+        return namespace
+
+    @staticmethod
+    def _lookup(df: pd.DataFrame, computed: dict[str, Any], name: str) -> Any:
+        """Look up a column, preferring values computed in this apply()."""
+        return computed[name] if name in computed else df[name]
+
+    @staticmethod
+    def _to_raw(value: Any) -> Any:
+        """Unwrap a numeric Series to its NumPy array (a view, not a copy).
+
+        bool[pyarrow] masks without nulls (e.g. from @startswith) become
+        NumPy bool arrays. Other values, including strings and other
+        extension dtypes, stay as they are.
+        """
+        if isinstance(value, pd.Series):
+            dtype = value.dtype
+            if isinstance(dtype, np.dtype) and dtype.kind in "biufc":
+                return value.to_numpy()
+            if isinstance(dtype, pd.ArrowDtype) and dtype.kind == "b":
+                if not value.hasnans:
+                    return value.to_numpy(bool)
+        return value
+
+    def _numexpr_expression(
+        self, df: pd.DataFrame, formula: str, computed: dict[str, Any]
+    ) -> str | None:
+        """Return the numexpr form of a formula, or None to use the Python path.
+
+        Only formulas built purely from operator functions (add, mul, gt, ...)
+        over numeric columns qualify, and only on frames large enough for
+        numexpr to beat plain NumPy. Such expressions are handed straight to
+        numexpr.evaluate with the underlying arrays, bypassing pandas eval.
+        """
+        if compiler.numexpr is None or len(df) < compiler.NUMEXPR_MIN_ROWS:
+            return None
+
+        expression = self._expand(formula)
+        if expression is None:
+            return None
+
+        names = compiler.referenced_names(expression)
+        if not names:
+            return None
+        for name in names:
+            if name not in computed and name not in df.columns:
+                return None
+            dtype = getattr(self._lookup(df, computed, name), "dtype", None)
+            if not compiler.is_numexpr_dtype(dtype):
+                return None
+        return expression
+
+    def _resolve_function(self, name: str) -> Callable | None:
+        """Look up a registered function, returning None if missing.
+
+        Constants shadow functions of the same name, so they resolve to None.
+        """
+        if name in self._constants or not self._registry.has(name):
+            return None
+        return self._registry.get(name)
+
+    def _is_pure(self, name: str) -> bool:
+        """Check whether a registered function is a side-effect-free operator."""
+        return compiler.is_pure(self._resolve_function(name))
+
+    def _is_where(self, name: str) -> bool:
+        """Check whether a registered function is np.where (e.g. @if_else)."""
+        return compiler.is_where(self._resolve_function(name))
 
     def _resolve_formulas(self, formulas: dict[str, str] | None) -> dict[str, str]:
         """Resolve formulas, using internal formulas if none provided."""
         return formulas or self._formulas
 
+    def _dependencies(self, formulas: dict[str, str]) -> dict[str, set[str]]:
+        """Build the formula dependency DAG.
+
+        A formula can only see columns computed by formulas listed before it;
+        any other reference reads the input DataFrame. Edges therefore always
+        point backwards and the dict order is a valid topological order.
+
+        Args:
+            formulas: Dict of column -> formula
+
+        Returns:
+            Dict of column -> earlier formula columns it references
+        """
+        deps: dict[str, set[str]] = {}
+        for column, formula in formulas.items():
+            deps[column] = set(compiler.referenced_names(formula) & deps.keys())
+        return deps
+
+    def _plan(
+        self, formulas: dict[str, str], outputs: set[str]
+    ) -> list[tuple[str, str]]:
+        """Plan the evaluation of formulas, fusing transient arithmetic.
+
+        Pure operator formulas (see compiler.to_numexpr) whose column is not
+        an output are substituted into pure operator consumers, so a chain
+        like step1 = @mul(a, 2), step2 = @add(step1, b) runs as the single
+        formula @add(@mul(a, 2), b) and step1 is never materialized. Formulas
+        nobody needs are dropped. Steps keep their @function calls, so
+        _eval_formula still picks numexpr or the registered (e.g. Numba
+        accelerated) functions per call.
+
+        Args:
+            formulas: Dict of column -> formula
+            outputs: Columns that must be produced
+
+        Returns:
+            List of (column, formula to evaluate) in evaluation order
+        """
+        deps = self._dependencies(formulas)
+        columns = list(formulas)
+        position = {column: i for i, column in enumerate(columns)}
+
+        fused: dict[str, str] = {}
+        pure: set[str] = set()
+        effective: dict[str, set[str]] = {}
+        for column in columns:
+            formula = formulas[column]
+            needs = set(deps[column])
+            if self._expand(formula) is not None:
+                pure.add(column)
+                inline = {}
+                for dep in deps[column]:
+                    if dep in outputs or dep not in pure:
+                        continue
+                    # Inlining must not change what the dep's own names refer to
+                    between = set(columns[position[dep] + 1:position[column]])
+                    if between & compiler.referenced_names(fused[dep]):
+                        continue
+                    inline[dep] = fused[dep]
+                    needs = (needs - {dep}) | effective[dep]
+                if inline:
+                    formula = compiler.inline(formula, inline)
+            fused[column] = formula
+            effective[column] = needs
+
+        needed: set[str] = set()
+        stack = [column for column in columns if column in outputs]
+        while stack:
+            column = stack.pop()
+            if column not in needed:
+                needed.add(column)
+                stack.extend(effective[column])
+
+        return [(column, fused[column]) for column in columns if column in needed]
+
     def apply(
         self,
         df: pd.DataFrame,
         formulas: dict[str, str] | None = None,
         inplace: bool = False,
+        outputs: list[str] | None = None,
     ) -> pd.DataFrame:
         """Apply formulas to a DataFrame.
 
@@ -159,35 +434,159 @@ class FormulaEngine:
             formulas: Dict of column -> formula. If None, uses formulas
                      added via add_formula()
             inplace: If True, modify df directly (default: False)
+            outputs: Formula columns to add to the result. Other formulas are
+                     treated as intermediates and never inserted into the
+                     result (default: all formula columns)
 
         Returns:
             DataFrame with calculated columns
 
         Raises:
-            ValueError: If formula evaluation fails
+            ValueError: If formula evaluation fails or outputs names a
+                column without a formula
         """
-        result = df if inplace else df.copy()
+        # Shallow copy: untouched columns share memory with df, and pandas'
+        # copy-on-write keeps df intact when result columns are written
+        result = df if inplace else df.copy(deep=False)
 
         formulas = self._resolve_formulas(formulas)
         if not formulas:
             return result
 
+        keep = set(formulas) if outputs is None else set(outputs)
+        unknown = keep - formulas.keys()
+        if unknown:
+            raise ValueError(f"No formula for output columns: {sorted(unknown)}")
+
+        # Planning parses every formula, so report syntax errors per column
         for column, formula in formulas.items():
             try:
-                self._eval_formula(result, column, formula)
-            except Exception as e:
-                raise ValueError(
-                    f"Failed to evaluate formula for '{column}': {formula}\n"
-                    f"Error: {e}"
-                ) from e
+                compiler.parse_formula(formula)
+            except SyntaxError as e:
+                raise self._formula_error(column, formula, e) from e
+
+        steps = self._plan(formulas, keep)
+        computed: dict[str, Any] = {}
+        with conversion_cache():
+            if self._max_workers == 1:
+                for step in steps:
+                    computed[step[0]] = self._eval_step(
+                        result, computed, formulas, step
+                    )
+            else:
+                with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                    for level in self._levels(steps):
+                        # Worker threads see the conversion cache via a copy
+                        # of this context (one per task, contexts are not
+                        # re-entrant)
+                        contexts = [contextvars.copy_context() for _ in level]
+                        values = executor.map(
+                            lambda context, step: context.run(
+                                self._eval_step, result, computed, formulas, step
+                            ),
+                            contexts,
+                            level,
+                        )
+                        computed.update(zip((column for column, _ in level), values))
+
+        columns = {column: computed[column] for column, _ in steps if column in keep}
+        return self._assign(result, columns, inplace)
+
+    @staticmethod
+    def _assign(
+        result: pd.DataFrame, columns: dict[str, Any], inplace: bool
+    ) -> pd.DataFrame:
+        """Write computed columns into the result in one batch.
+
+        Columns that already exist are overwritten in place. New columns are
+        gathered into one frame and appended with a single concat, instead of
+        growing the result one column (and one internal block) at a time.
+        Inserting into the caller's DataFrame (inplace) has to go column by
+        column.
+        """
+        new = {}
+        for column, value in columns.items():
+            if inplace or column in result.columns:
+                result[column] = value
+            else:
+                new[column] = value
+        if not new:
+            return result
+        added = pd.DataFrame(new, index=result.index)
+        return pd.concat([result, added], axis=1).__finalize__(result)
+
+    def _eval_step(
+        self,
+        df: pd.DataFrame,
+        computed: dict[str, Any],
+        formulas: dict[str, str],
+        step: tuple[str, str],
+    ) -> Any:
+        """Evaluate one planned step, reporting failures against its column."""
+        column, formula = step
+        try:
+            return self._as_column(df, self._eval_formula(df, formula, computed))
+        except Exception as e:
+            raise self._formula_error(column, formulas[column], e) from e
+
+    @staticmethod
+    def _formula_error(column: str, formula: str, error: Exception) -> ValueError:
+        """Build the error apply() raises for a formula that failed."""
+        return ValueError(
+            f"Failed to evaluate formula for '{column}': {formula}\nError: {error}"
+        )
 
-        return result
+    @staticmethod
+    def _as_column(df: pd.DataFrame, value: Any) -> pd.Series:
+        """Wrap an array or scalar result as a Series aligned with df.
+
+        Raw and numexpr evaluation return bare arrays, aggregations return
+        scalars, and functions such as @dropna return a Series with fewer
+        rows. Later formulas must read every computed column as a Series on
+        df's index, exactly like a column of df (e.g. @std uses the Series'
+        ddof=1, and missing rows are NaN).
+        """
+        if isinstance(value, pd.Series):
+            if value.index.equals(df.index):
+                return value
+            return value.reindex(df.index)
+        return pd.Series(value, index=df.index)
+
+    @staticmethod
+    def _levels(steps: list[tuple[str, str]]) -> list[list[tuple[str, str]]]:
+        """Group planned steps into levels that can run concurrently.
+
+        A step runs one level after the steps whose columns it reads, and no
+        earlier than any earlier step that reads the column it overwrites
+        (results are only stored once a whole level has finished).
+        """
+        levels: list[list[tuple[str, str]]] = []
+        level_of: dict[str, int] = {}
+        read_at: dict[str, int] = {}
+        for column, formula in steps:
+            names = compiler.referenced_names(formula)
+            level = max(
+                [level_of[name] + 1 for name in names if name in level_of]
+                + [read_at.get(column, 0)]
+            )
+            level_of[column] = level
+            for name in names:
+                read_at[name] = max(read_at.get(name, 0), level)
+            if level == len(levels):
+                levels.append([])
+            levels[level].append((column, formula))
+        return levels
 
     def validate(
         self, df: pd.DataFrame, formulas: dict[str, str] | None = None
     ) -> list[str]:
         """Validate formulas against a DataFrame without executing.
 
+        Checks statically that every formula parses, that every @function is
+        registered, and that every referenced column exists in df or is
+        produced by an earlier formula. Nothing is evaluated, so type errors
+        that only show up at runtime are not detected.
+
         Args:
             df: DataFrame to validate against
             formulas: Formulas to validate (or use internal formulas)
@@ -195,47 +594,56 @@ class FormulaEngine:
         Returns:
             List of error messages (empty if valid)
         """
-        sample = df.head(1).copy()
-
         formulas = self._resolve_formulas(formulas)
+        known = set(df.columns) | self._constants.keys()
         errors = []
 
         for column, formula in formulas.items():
             try:
-                self._eval_formula(sample, column, formula)
-            except Exception as e:
-                errors.append(f"{column}: {e}")
+                _, func_names = compile_formula(formula)
+            except SyntaxError as e:
+                errors.append(f"{column}: invalid syntax: {e.msg}")
+                known.add(column)
+                continue
+
+            unknown_funcs = sorted(
+                n for n in func_names
+                if n not in self._constants and not self._registry.has(n)
+            )
+            if unknown_funcs:
+                names = ", ".join(f"@{n}" for n in unknown_funcs)
+                errors.append(f"{column}: unknown function(s): {names}")
+
+            unknown_columns = sorted(compiler.referenced_names(formula) - known)
+            if unknown_columns:
+                names = ", ".join(unknown_columns)
+                errors.append(f"{column}: unknown column(s): {names}")
+
+            known.add(column)
 
         return errors
 
-    def extract_references(self, formula: str) -> set[str]:
+    @staticmethod
+    def extract_references(formula: str) -> set[str]:
         """Extract column name references from a formula string.
 
         Statically analyzes without executing. Returns identifiers that are
-        not registered functions, numeric literals, or keyword arguments.
+        not registered functions, literals, or keyword arguments. The analysis
+        is cached per formula string; it does not depend on the registry.
 
         Args:
             formula: Formula string (e.g. '@my_func(argument)')
 
         Returns:
             Set of referenced column names (e.g. {'argument'})
-        """
-        func_names = set(_FUNC_PATTERN.findall(formula))
-        kwarg_names = set(_KWARG_PATTERN.findall(formula))
-        # Remove string literals and scientific notation before extracting identifiers
-        cleaned = _STRING_LITERAL.sub("", formula)
-        cleaned = _SCI_NOTATION.sub("", cleaned)
-        all_ids = set(_IDENTIFIER_PATTERN.findall(cleaned))
 
-        return {
-            name
-            for name in all_ids
-            if name not in func_names
-            and name not in kwarg_names
-            and not _NUMERIC_PATTERN.match(name)
-        }
+        Raises:
+            SyntaxError: If the formula is not a valid expression
+        """
+        return set(compiler.referenced_names(formula))
 
-    def extract_references_batch(self, formulas: dict[str, str]) -> set[str]:
+    @staticmethod
+    def extract_references_batch(formulas: dict[str, str]) -> set[str]:
         """Extract all column references from a dict of formulas.
 
         Args:
@@ -244,10 +652,7 @@ class FormulaEngine:
         Returns:
             Union of all referenced column names across all formulas
         """
-        refs = set()
-        for formula in formulas.values():
-            refs |= self.extract_references(formula)
-        return refs
+        return set().union(*map(compiler.referenced_names, formulas.values()))
 
     def list_functions(self) -> list[str]:
         """List all registered functions."""
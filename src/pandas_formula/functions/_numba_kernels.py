@@ -0,0 +1,252 @@
+"""
+Optional Numba kernels: ufuncs for elementwise arithmetic and comparisons,
+and short-literal prefix/suffix tests over Arrow string buffers.
+
+Kernels are compiled for an explicit list of signatures (so no type-driven
+recompilation ever happens at call time) on first use, and cached on disk.
+Without Numba installed, accelerate() returns the plain operator unchanged
+and match_affix() returns None.
+"""
+
+from __future__ import annotations
+
+import functools
+import operator
+import threading
+from typing import Callable
+
+import numpy as np
+
+try:
+    from numba import njit, types, vectorize
+except ImportError:  # pragma: no cover - optional dependency
+    njit = types = vectorize = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pragma: no cover - optional dependency
+    pa = pc = None
+
+# Below this size thread start-up costs more than the parallel loop saves.
+MIN_SIZE = 100_000
+
+# Prefix/suffix literals up to this many UTF-8 bytes use match_affix(), and
+# only on columns of at least MIN_STRINGS rows.
+MAX_AFFIX_BYTES = 8
+MIN_STRINGS = 10_000
+
+_SIGNATURES = {
+    "arith": ["float64(float64, float64)", "int64(int64, int64)"],
+    "div": ["float64(float64, float64)"],
+    "compare": ["boolean(float64, float64)", "boolean(int64, int64)"],
+}
+
+_OPERATORS: dict[Callable, str] = {
+    operator.add: "arith",
+    operator.sub: "arith",
+    operator.mul: "arith",
+    operator.truediv: "div",
+    operator.eq: "compare",
+    operator.ne: "compare",
+    operator.gt: "compare",
+    operator.ge: "compare",
+    operator.lt: "compare",
+    operator.le: "compare",
+}
+
+_KERNEL_DTYPES = (np.dtype(np.float64), np.dtype(np.int64))
+
+# Numba's default threading layer cannot run parallel kernels from several
+# threads at once (e.g. FormulaEngine(max_workers=...)), so launches queue up.
+_LAUNCH_LOCK = threading.Lock()
+
+
+def _add(a, b):
+    return a + b
+
+
+def _sub(a, b):
+    return a - b
+
+
+def _mul(a, b):
+    return a * b
+
+
+def _truediv(a, b):
+    return a / b
+
+
+def _eq(a, b):
+    return a == b
+
+
+def _ne(a, b):
+    return a != b
+
+
+def _gt(a, b):
+    return a > b
+
+
+def _ge(a, b):
+    return a >= b
+
+
+def _lt(a, b):
+    return a < b
+
+
+def _le(a, b):
+    return a <= b
+
+
+_SCALAR_FUNCS: dict[Callable, Callable] = {
+    operator.add: _add,
+    operator.sub: _sub,
+    operator.mul: _mul,
+    operator.truediv: _truediv,
+    operator.eq: _eq,
+    operator.ne: _ne,
+    operator.gt: _gt,
+    operator.ge: _ge,
+    operator.lt: _lt,
+    operator.le: _le,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _kernel(op: Callable) -> Callable:
+    """Compile the parallel ufunc for an operator (once per process)."""
+    signatures = _SIGNATURES[_OPERATORS[op]]
+    return vectorize(signatures, target="parallel", cache=True)(_SCALAR_FUNCS[op])
+
+
+def _kernel_operands(a, b) -> tuple[np.ndarray, np.ndarray] | None:
+    """Coerce operands to a single kernel dtype, or None if not eligible.
+
+    Only large float64/int64 ndarrays qualify; a Python scalar operand is
+    cast to the array's dtype when NumPy would keep that dtype anyway, so the
+    result dtype always matches the plain operator.
+    """
+    if not isinstance(a, np.ndarray):
+        return None
+    if a.dtype not in _KERNEL_DTYPES or a.size < MIN_SIZE:
+        return None
+    if isinstance(b, np.ndarray):
+        return (a, b) if b.dtype == a.dtype and b.shape == a.shape else None
+    if isinstance(b, float) and a.dtype.kind == "f":
+        return a, np.float64(b)
+    if isinstance(b, int) and not isinstance(b, bool):
+        return a, a.dtype.type(b)
+    return None
+
+
+def accelerate(op: Callable) -> Callable:
+    """Wrap a binary operator so large numeric arrays use a Numba kernel.
+
+    Args:
+        op: One of the operator module functions (e.g. operator.add)
+
+    Returns:
+        op itself when Numba is not installed, otherwise a wrapper that
+        falls back to op for Series, strings, small arrays, ...
+    """
+    if vectorize is None:
+        return op
+
+    @functools.wraps(op)
+    def func(a, b):
+        operands = _kernel_operands(a, b)
+        if operands is None:
+            return op(a, b)
+        kernel = _kernel(op)
+        with _LAUNCH_LOCK:
+            return kernel(*operands)
+
+    return func
+
+
+def _starts_with(data, offsets, needle):
+    n = needle.size
+    out = np.zeros(offsets.size - 1, np.bool_)
+    for i in range(out.size):
+        start = offsets[i]
+        if offsets[i + 1] - start >= n:
+            match = True
+            for k in range(n):
+                if data[start + k] != needle[k]:
+                    match = False
+                    break
+            out[i] = match
+    return out
+
+
+def _ends_with(data, offsets, needle):
+    n = needle.size
+    out = np.zeros(offsets.size - 1, np.bool_)
+    for i in range(out.size):
+        start = offsets[i + 1] - n
+        if start >= offsets[i]:
+            match = True
+            for k in range(n):
+                if data[start + k] != needle[k]:
+                    match = False
+                    break
+            out[i] = match
+    return out
+
+
+@functools.lru_cache(maxsize=None)
+def _affix_kernel(suffix: bool) -> Callable:
+    """Compile the prefix or suffix test (once per process)."""
+    data = types.Array(types.uint8, 1, "A", readonly=True)
+    needle = types.Array(types.uint8, 1, "A", readonly=True)
+    signatures = [
+        types.Array(types.boolean, 1, "C")(
+            data, types.Array(offset, 1, "A", readonly=True), needle
+        )
+        for offset in (types.int32, types.int64)
+    ]
+    return njit(signatures, cache=True)(_ends_with if suffix else _starts_with)
+
+
+def match_affix(arr, affix: str, suffix: bool = False) -> np.ndarray | None:
+    """Test Arrow strings for a short literal prefix (or suffix).
+
+    A compiled loop over the raw UTF-8 data and offsets buffers compares at
+    most MAX_AFFIX_BYTES bytes per row, avoiding the general kernel's
+    per-row setup. Missing strings give False.
+
+    Args:
+        arr: pyarrow string or large_string Array or ChunkedArray
+        affix: Literal prefix (or suffix)
+        suffix: Test the end of each string instead of the start
+
+    Returns:
+        Boolean ndarray, or None when Numba/pyarrow are not installed or the
+        input does not qualify (long or empty literal, small column, ...)
+    """
+    if njit is None or pa is None or len(arr) < MIN_STRINGS:
+        return None
+    needle = np.frombuffer(affix.encode(), np.uint8)
+    if not 0 < needle.size <= MAX_AFFIX_BYTES:
+        return None
+    if not (pa.types.is_string(arr.type) or pa.types.is_large_string(arr.type)):
+        return None
+
+    kernel = _affix_kernel(suffix)
+    offset_type = np.int64 if pa.types.is_large_string(arr.type) else np.int32
+    chunks = arr.chunks if isinstance(arr, pa.ChunkedArray) else [arr]
+    results = []
+    for chunk in chunks:
+        _, offsets, data = chunk.buffers()
+        offsets = np.frombuffer(offsets, offset_type)
+        offsets = offsets[chunk.offset:chunk.offset + len(chunk) + 1]
+        data = np.frombuffer(data, np.uint8) if data is not None else needle[:0]
+        result = kernel(data, offsets, needle)
+        if chunk.null_count:
+            result &= pc.is_valid(chunk).to_numpy(zero_copy_only=False)
+        results.append(result)
+    return np.concatenate(results) if len(results) != 1 else results[0]
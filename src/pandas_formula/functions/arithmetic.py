@@ -1,19 +1,76 @@
 """Arithmetic functions."""
 
+import functools
+import operator
+
 import numpy as np
+import pandas as pd
 
+from ._numba_kernels import accelerate
 from .registry import FunctionRegistry
 
 
+def _numpy_bool(value):
+    """Convert a bool[pyarrow] Series to NumPy bool (boolean if it has nulls).
+
+    Arrow booleans support logic but no arithmetic, while masks such as
+    @startswith(name, 'c') are commonly counted or weighted.
+    """
+    if not isinstance(value, pd.Series):
+        return value
+    dtype = value.dtype
+    if not isinstance(dtype, pd.ArrowDtype) or dtype.kind != "b":
+        return value
+    return value.astype("boolean" if value.hasnans else bool)
+
+
+def on_numpy_bools(func):
+    """Let an arithmetic function take bool[pyarrow] masks like NumPy masks."""
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        return func(*map(_numpy_bool, args))
+
+    return wrapper
+
+
 def register_arithmetic_functions(registry: FunctionRegistry) -> None:
     """Register arithmetic functions."""
 
-    registry.register("add", lambda a, b: a + b, "Add two values: @add(a, b)")
-    registry.register("sub", lambda a, b: a - b, "Subtract: @sub(a, b)")
-    registry.register("mul", lambda a, b: a * b, "Multiply: @mul(a, b)")
-    registry.register("div", lambda a, b: a / b, "Divide: @div(a, b)")
-    registry.register("floordiv", lambda a, b: a // b, "Floor divide: @floordiv(a, b)")
-    registry.register("mod", lambda a, b: a % b, "Modulo: @mod(a, b)")
-    registry.register("pow", lambda a, b: a ** b, "Power: @pow(a, b)")
-    registry.register("neg", lambda a: -a, "Negate: @neg(a)")
-    registry.register("abs", lambda a: np.abs(a), "Absolute value: @abs(a)")
+    registry.register(
+        "add",
+        on_numpy_bools(accelerate(operator.add)),
+        "Add two values: @add(a, b)",
+        raw=True
+    )
+    registry.register(
+        "sub",
+        on_numpy_bools(accelerate(operator.sub)),
+        "Subtract: @sub(a, b)",
+        raw=True
+    )
+    registry.register(
+        "mul",
+        on_numpy_bools(accelerate(operator.mul)),
+        "Multiply: @mul(a, b)",
+        raw=True
+    )
+    registry.register(
+        "div",
+        on_numpy_bools(accelerate(operator.truediv)),
+        "Divide: @div(a, b)",
+        raw=True
+    )
+    registry.register(
+        "floordiv",
+        on_numpy_bools(operator.floordiv),
+        "Floor divide: @floordiv(a, b)"
+    )
+    registry.register("mod", on_numpy_bools(operator.mod), "Modulo: @mod(a, b)")
+    registry.register(
+        "pow", on_numpy_bools(operator.pow), "Power: @pow(a, b)", raw=True
+    )
+    registry.register("neg", on_numpy_bools(operator.neg), "Negate: @neg(a)", raw=True)
+    registry.register(
+        "abs", on_numpy_bools(np.abs), "Absolute value: @abs(a)", raw=True
+    )
@@ -1,14 +1,32 @@
 """Comparison functions."""
 
+import operator
+
+from ._numba_kernels import accelerate
 from .registry import FunctionRegistry
 
 
 def register_comparison_functions(registry: FunctionRegistry) -> None:
     """Register comparison functions."""
 
-    registry.register("eq", lambda a, b: a == b, "Equal: @eq(a, b)")
-    registry.register("ne", lambda a, b: a != b, "Not equal: @ne(a, b)")
-    registry.register("gt", lambda a, b: a > b, "Greater than: @gt(a, b)")
-    registry.register("gte", lambda a, b: a >= b, "Greater than or equal: @gte(a, b)")
-    registry.register("lt", lambda a, b: a < b, "Less than: @lt(a, b)")
-    registry.register("lte", lambda a, b: a <= b, "Less than or equal: @lte(a, b)")
+    registry.register("eq", accelerate(operator.eq), "Equal: @eq(a, b)", raw=True)
+    registry.register("ne", accelerate(operator.ne), "Not equal: @ne(a, b)", raw=True)
+    registry.register(
+        "gt",
+        accelerate(operator.gt),
+        "Greater than: @gt(a, b)",
+        raw=True
+    )
+    registry.register(
+        "gte",
+        accelerate(operator.ge),
+        "Greater than or equal: @gte(a, b)",
+        raw=True
+    )
+    registry.register("lt", accelerate(operator.lt), "Less than: @lt(a, b)", raw=True)
+    registry.register(
+        "lte",
+        accelerate(operator.le),
+        "Less than or equal: @lte(a, b)",
+        raw=True
+    )
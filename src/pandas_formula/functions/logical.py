@@ -1,4 +1,11 @@
-"""Logical functions."""
+"""Logical functions.
+
+Nested @if_else chains such as @if_else(c1, 'A', @if_else(c2, 'B', 'F')) are
+fused by the compiler into a single @select([c1, c2], ['A', 'B'], 'F'), which
+scans the data once instead of once per level.
+"""
+
+import operator
 
 import numpy as np
 
@@ -8,11 +15,18 @@ from .registry import FunctionRegistry
 def register_logical_functions(registry: FunctionRegistry) -> None:
     """Register logical functions."""
 
-    registry.register("and_", lambda a, b: a & b, "Logical AND: @and_(a, b)")
-    registry.register("or_", lambda a, b: a | b, "Logical OR: @or_(a, b)")
-    registry.register("not_", lambda a: ~a, "Logical NOT: @not_(a)")
+    registry.register("and_", operator.and_, "Logical AND: @and_(a, b)", raw=True)
+    registry.register("or_", operator.or_, "Logical OR: @or_(a, b)", raw=True)
+    registry.register("not_", operator.invert, "Logical NOT: @not_(a)", raw=True)
     registry.register(
         "if_else",
-        lambda cond, true_val, false_val: np.where(cond, true_val, false_val),
-        "Conditional: @if_else(condition, true_value, false_value)"
+        np.where,
+        "Conditional: @if_else(condition, true_value, false_value)",
+        raw=True
+    )
+    registry.register(
+        "select",
+        np.select,
+        "First matching choice: @select([cond1, cond2], [val1, val2], default)",
+        raw=True
     )
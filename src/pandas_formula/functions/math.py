@@ -1,26 +1,53 @@
 """Math functions."""
 
 import numpy as np
+import pandas as pd
 
 from .registry import FunctionRegistry
 
 
+def _categorize(a, bins, labels=None, right=True):
+    """Bin values with pd.cut.
+
+    The result is categorical: one small integer code per row plus a single
+    copy of each label, instead of a Python string object per row.
+    """
+    return pd.cut(a, bins, labels=labels, right=right)
+
+
 def register_math_functions(registry: FunctionRegistry) -> None:
     """Register math functions."""
 
-    registry.register("round", lambda a, n=0: np.round(a, n), "Round: @round(a, 2)")
-    registry.register("ceil", lambda a: np.ceil(a), "Ceiling: @ceil(a)")
-    registry.register("floor", lambda a: np.floor(a), "Floor: @floor(a)")
-    registry.register("sqrt", lambda a: np.sqrt(a), "Square root: @sqrt(a)")
-    registry.register("log", lambda a: np.log(a), "Natural log: @log(a)")
-    registry.register("log10", lambda a: np.log10(a), "Log base 10: @log10(a)")
-    registry.register("log2", lambda a: np.log2(a), "Log base 2: @log2(a)")
-    registry.register("exp", lambda a: np.exp(a), "Exponential: @exp(a)")
-    registry.register("sin", lambda a: np.sin(a), "Sine: @sin(a)")
-    registry.register("cos", lambda a: np.cos(a), "Cosine: @cos(a)")
-    registry.register("tan", lambda a: np.tan(a), "Tangent: @tan(a)")
+    registry.register(
+        "round",
+        lambda a, n=0: np.round(a, n),
+        "Round: @round(a, 2)",
+        raw=True
+    )
+    registry.register("ceil", lambda a: np.ceil(a), "Ceiling: @ceil(a)", raw=True)
+    registry.register("floor", lambda a: np.floor(a), "Floor: @floor(a)", raw=True)
+    registry.register("sqrt", lambda a: np.sqrt(a), "Square root: @sqrt(a)", raw=True)
+    registry.register("log", lambda a: np.log(a), "Natural log: @log(a)", raw=True)
+    registry.register(
+        "log10",
+        lambda a: np.log10(a),
+        "Log base 10: @log10(a)",
+        raw=True
+    )
+    registry.register("log2", lambda a: np.log2(a), "Log base 2: @log2(a)", raw=True)
+    registry.register("exp", lambda a: np.exp(a), "Exponential: @exp(a)", raw=True)
+    registry.register("sin", lambda a: np.sin(a), "Sine: @sin(a)", raw=True)
+    registry.register("cos", lambda a: np.cos(a), "Cosine: @cos(a)", raw=True)
+    registry.register("tan", lambda a: np.tan(a), "Tangent: @tan(a)", raw=True)
     registry.register(
         "clip",
         lambda a, lower, upper: np.clip(a, lower, upper),
-        "Clip values: @clip(a, 0, 100)"
+        "Clip values: @clip(a, 0, 100)",
+        raw=True
+    )
+    registry.register(
+        "categorize",
+        _categorize,
+        "Bin into labeled categories: @categorize(a, [0, 50, 100], ['low', 'high'])",
+        raw=True
     )
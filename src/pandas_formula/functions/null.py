@@ -1,22 +1,114 @@
 """Null handling functions."""
 
+import numpy as np
+import pandas as pd
+
 from .registry import FunctionRegistry
 
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pragma: no cover - optional dependency
+    pa = pc = None
+
+
+def _arrow_array(a):
+    """Return the Arrow data behind an Arrow-backed Series, else None."""
+    if pc is None or not isinstance(a, pd.Series):
+        return None
+    if not isinstance(a.array, pd.arrays.ArrowExtensionArray):
+        return None
+    return pa.array(a)
+
+
+def _bool_series(a: pd.Series, mask) -> pd.Series:
+    """Wrap an Arrow boolean array as a bool[pyarrow] Series shaped like a."""
+    return pd.Series(
+        pd.array(mask, dtype=pd.ArrowDtype(pa.bool_())), index=a.index, name=a.name
+    )
+
+
+def _isnull(a):
+    """Check for missing values; Arrow-backed columns give bool[pyarrow]."""
+    arr = _arrow_array(a)
+    if arr is None:
+        return a.isnull()
+    return _bool_series(a, pc.is_null(arr))
+
+
+def _notnull(a):
+    """Check for present values; Arrow-backed columns give bool[pyarrow]."""
+    arr = _arrow_array(a)
+    if arr is None:
+        return a.notnull()
+    return _bool_series(a, pc.is_valid(arr))
+
+
+def _arrow_coalesce(a: pd.Series, arr, b):
+    """Coalesce an Arrow-backed Series in one pc.coalesce pass, if possible.
+
+    Returns None when b cannot be expressed in a's Arrow type.
+    """
+    if isinstance(b, pd.Series):
+        fill = _arrow_array(b)
+        if fill is None or fill.type != arr.type or not b.index.equals(a.index):
+            return None
+    else:
+        try:
+            fill = pa.scalar(b, type=arr.type)
+        except (pa.ArrowException, TypeError, ValueError):
+            return None
+    result = pc.coalesce(arr, fill)
+    return pd.Series(pd.array(result, dtype=a.dtype), index=a.index, name=a.name)
+
+
+def _coalesce(a, b):
+    """Replace missing values in a with b.
+
+    NumPy float arrays and Series with a numeric fill take a single np.where
+    pass, plain int/bool arrays cannot hold nulls and Arrow-backed columns
+    use a single pc.coalesce; anything else (object strings, nullable
+    dtypes, ...) goes through pandas fillna. Series come back as Series.
+    """
+    arrow = _arrow_array(a)
+    if arrow is not None:
+        result = _arrow_coalesce(a, arrow, b)
+        if result is not None:
+            return result
+    dtype = getattr(a, "dtype", None)
+    if isinstance(a, np.ndarray) and dtype.kind in "biu":
+        return a
+    if (
+        isinstance(dtype, np.dtype)
+        and dtype.kind == "f"
+        and np.asarray(b).dtype.kind in "biuf"
+    ):
+        arr = np.asarray(a)
+        result = np.where(np.isnan(arr), b, arr)
+        if isinstance(a, pd.Series):
+            return pd.Series(result, index=a.index, name=a.name)
+        return result
+    if isinstance(a, pd.Series):
+        return a.fillna(b)
+    return pd.Series(a).fillna(b).to_numpy()
+
 
 def register_null_functions(registry: FunctionRegistry) -> None:
     """Register null handling functions."""
 
-    registry.register("isnull", lambda a: a.isnull(), "Check null: @isnull(a)")
-    registry.register("notnull", lambda a: a.notnull(), "Check not null: @notnull(a)")
+    registry.register("isnull", _isnull, "Check null: @isnull(a)")
+    registry.register("notnull", _notnull, "Check not null: @notnull(a)")
     registry.register(
         "coalesce",
-        lambda a, b: a.fillna(b),
-        "Return first non-null: @coalesce(a, b)"
+        _coalesce,
+        "Return first non-null: @coalesce(a, b)",
+        raw=True
     )
     registry.register(
         "fillna",
-        lambda a, val: a.fillna(val),
-        "Fill null with value: @fillna(a, 0)"
+        _coalesce,
+        "Fill null with value: @fillna(a, 0)",
+        raw=True
     )
     registry.register(
         "dropna",
@@ -2,34 +2,83 @@
 Function registry for managing formula functions.
 """
 
-from typing import Callable, Any
+from types import MappingProxyType
+from typing import Callable
 
 
 class FunctionRegistry:
     """Registry for formula functions.
 
-    Functions are stored as attributes so they can be passed to df.eval()
-    via local_dict=self.__dict__.
+    Functions are stored as attributes; as_dict() exposes them as a
+    read-only mapping.
     """
 
     def __init__(self):
+        self._function_names: set[str] = set()
         self._function_docs: dict[str, str] = {}
-
-    def register(self, name: str, func: Callable, doc: str = "") -> "FunctionRegistry":
+        self._raw_functions: set[str] = set()
+        self._version = 0
+        self._view: MappingProxyType[str, Callable] | None = None
+
+    @property
+    def version(self) -> int:
+        """Counter bumped on every change, for invalidating cached lookups."""
+        return self._version
+
+    def register(
+        self, name: str, func: Callable, doc: str = "", raw: bool = False
+    ) -> "FunctionRegistry":
         """Register a function with the given name.
 
         Args:
             name: Function name (will be called as @name in formulas)
             func: The function implementation
             doc: Optional documentation string
+            raw: Whether the function works on plain NumPy arrays. Formulas
+                calling only raw functions receive numeric columns as
+                ndarrays instead of Series (default: False)
+
+        Returns:
+            self for method chaining
+        """
+        self._add(name, func, doc, raw)
+        self._version += 1
+        self._view = None
+        return self
+
+    def register_batch(
+        self, functions: dict[str, Callable | tuple[Callable, str]]
+    ) -> "FunctionRegistry":
+        """Register multiple functions at once.
+
+        Cached lookups are invalidated once for the whole batch.
+
+        Args:
+            functions: Dict of name -> func, or name -> (func, doc)
 
         Returns:
             self for method chaining
         """
+        for name, entry in functions.items():
+            if isinstance(entry, tuple):
+                func, doc = entry
+            else:
+                func, doc = entry, ""
+            self._add(name, func, doc, raw=False)
+        self._version += 1
+        self._view = None
+        return self
+
+    def _add(self, name: str, func: Callable, doc: str, raw: bool) -> None:
+        """Store a function and its metadata, without invalidating caches."""
         setattr(self, name, func)
+        self._function_names.add(name)
         if doc:
             self._function_docs[name] = doc
-        return self
+        if raw:
+            self._raw_functions.add(name)
+        else:
+            self._raw_functions.discard(name)
 
     def unregister(self, name: str) -> "FunctionRegistry":
         """Remove a function from the registry.
@@ -40,14 +89,18 @@ class FunctionRegistry:
         Returns:
             self for method chaining
         """
-        if hasattr(self, name):
+        if name in self._function_names:
             delattr(self, name)
+            self._function_names.discard(name)
         self._function_docs.pop(name, None)
+        self._raw_functions.discard(name)
+        self._version += 1
+        self._view = None
         return self
 
     def has(self, name: str) -> bool:
         """Check if a function is registered."""
-        return hasattr(self, name) and name != "_function_docs"
+        return name in self._function_names
 
     def get(self, name: str) -> Callable:
         """Get a function by name.
@@ -59,17 +112,26 @@ class FunctionRegistry:
             raise KeyError(f"Function '{name}' not registered")
         return getattr(self, name)
 
+    def is_raw(self, name: str) -> bool:
+        """Check if a function was registered as accepting raw NumPy arrays."""
+        return name in self._raw_functions
+
     def list_functions(self) -> list[str]:
-        """List all registered function names."""
-        return [
-            k for k in self.__dict__.keys()
-            if not k.startswith("_") and callable(getattr(self, k))
-        ]
+        """List all registered function names, sorted."""
+        return sorted(self._function_names)
 
     def get_doc(self, name: str) -> str:
         """Get documentation for a function."""
         return self._function_docs.get(name, "")
 
-    def as_dict(self) -> dict[str, Any]:
-        """Return registry as dict for df.eval() local_dict parameter."""
-        return self.__dict__
+    def as_dict(self) -> MappingProxyType[str, Callable]:
+        """Return a read-only name -> function mapping of the registry.
+
+        The mapping is built once and reused until the next register() or
+        unregister().
+        """
+        if self._view is None:
+            self._view = MappingProxyType(
+                {name: getattr(self, name) for name in self._function_names}
+            )
+        return self._view
@@ -1,54 +1,353 @@
 """String functions."""
 
+import contextlib
+import contextvars
+import functools
+import operator
+import re
+
+import numpy as np
+import pandas as pd
+
+from . import _numba_kernels
 from .registry import FunctionRegistry
 
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pragma: no cover - optional dependency
+    pa = pc = None
 
-def register_string_functions(registry: FunctionRegistry) -> None:
-    """Register string functions."""
 
-    registry.register("upper", lambda a: a.str.upper(), "Uppercase: @upper(a)")
-    registry.register("lower", lambda a: a.str.lower(), "Lowercase: @lower(a)")
-    registry.register("strip", lambda a: a.str.strip(), "Strip whitespace: @strip(a)")
-    registry.register("lstrip", lambda a: a.str.lstrip(), "Left strip: @lstrip(a)")
-    registry.register("rstrip", lambda a: a.str.rstrip(), "Right strip: @rstrip(a)")
-    registry.register(
-        "concat",
-        lambda a, b: a.astype(str) + b.astype(str),
-        "Concatenate: @concat(a, b)"
-    )
-    registry.register(
-        "concat3",
-        lambda a, b, c: a.astype(str) + b.astype(str) + c.astype(str),
-        "Concatenate 3: @concat3(a, b, c)"
-    )
-    registry.register(
-        "concat_sep",
-        lambda a, b, sep: a.str.cat(b, sep=sep),
-        "Concatenate with separator: @concat_sep(a, b, ' ')"
-    )
-    registry.register("str_len", lambda a: a.str.len(), "String length: @str_len(a)")
-    registry.register(
-        "contains",
-        lambda a, pattern: a.str.contains(pattern, na=False),
-        "Contains pattern: @contains(a, 'pattern')"
-    )
-    registry.register(
-        "startswith",
-        lambda a, prefix: a.str.startswith(prefix, na=False),
-        "Starts with: @startswith(a, 'prefix')"
+# Arrow conversions made inside conversion_cache(), keyed by the address,
+# length and dtype of the converted column's values. Each entry keeps the
+# source Series alive so the address cannot be reused meanwhile.
+_conversions: contextvars.ContextVar[dict | None] = contextvars.ContextVar(
+    "pandas_formula_conversions", default=None
+)
+
+
+@contextlib.contextmanager
+def conversion_cache():
+    """Convert each Python-object string column to Arrow at most once.
+
+    FormulaEngine.apply() evaluates all formulas inside this block, so a
+    column read by several string formulas is converted only once. The
+    cached data must not be modified while the block is active.
+    """
+    token = _conversions.set({})
+    try:
+        yield
+    finally:
+        _conversions.reset(token)
+
+
+def _to_arrow_str(a):
+    """Move a Python-object string column onto Arrow storage.
+
+    .str methods on Arrow-backed strings run as compiled kernels over one
+    contiguous UTF-8 buffer instead of a Python call per element. Columns
+    that are already Arrow-backed, object columns holding anything but
+    strings, and non-Series values are returned unchanged.
+    """
+    if pa is None or not isinstance(a, pd.Series):
+        return a
+    dtype = a.dtype
+    if isinstance(dtype, pd.StringDtype) and dtype.storage == "python":
+        target = pd.StringDtype("pyarrow", na_value=dtype.na_value)
+    elif dtype == object:
+        target = pd.StringDtype("pyarrow", na_value=np.nan)
+    else:
+        return a
+
+    cache = _conversions.get()
+    key = None
+    if cache is not None:
+        key = (np.asarray(a).__array_interface__["data"][0], len(a), dtype)
+        if key in cache:
+            return pd.Series(cache[key][1], index=a.index, name=a.name)
+
+    if dtype == object and pd.api.types.infer_dtype(a, skipna=True) != "string":
+        converted = a
+    else:
+        converted = a.astype(target)
+    if key is not None:
+        cache[key] = (a, converted.array)
+    return converted
+
+
+def on_unique(func):
+    """Evaluate a string function once per distinct value of a Python column.
+
+    Columns of Python string objects (object dtype, or StringDtype with
+    python storage) cost a Python call per element. When at most half of
+    the values are distinct, func runs on the distinct values only and the
+    results are gathered back to rows, making the work O(unique) instead
+    of O(rows). Missing values of any kind are treated as one value. Arrow-backed
+    columns already run in compiled kernels and are passed through untouched.
+    """
+
+    @functools.wraps(func)
+    def wrapper(a, *args, **kwargs):
+        if isinstance(a, pd.Series) and (
+            a.dtype == object
+            or isinstance(a.dtype, pd.StringDtype) and a.dtype.storage == "python"
+        ):
+            codes, uniques = pd.factorize(a, use_na_sentinel=False)
+            if len(uniques) * 2 <= len(a):
+                result = func(pd.Series(uniques), *args, **kwargs)
+                return result.take(codes).set_axis(a.index).rename(a.name)
+        return func(a, *args, **kwargs)
+
+    return wrapper
+
+
+def _is_arrow_str(a) -> bool:
+    """Check for a Series of pandas strings stored in pyarrow."""
+    return (
+        pc is not None
+        and isinstance(a, pd.Series)
+        and isinstance(a.dtype, pd.StringDtype)
+        and a.dtype.storage == "pyarrow"
     )
-    registry.register(
-        "endswith",
-        lambda a, suffix: a.str.endswith(suffix, na=False),
-        "Ends with: @endswith(a, 'suffix')"
+
+
+def _is_ascii(arr) -> bool:
+    """Check that an Arrow string array holds only ASCII text.
+
+    Scans the raw UTF-8 data buffers with NumPy, which is far cheaper than
+    a per-string check. Bytes outside the array's slice can only make the
+    answer False, never wrongly True.
+    """
+    chunks = arr.chunks if isinstance(arr, pa.ChunkedArray) else [arr]
+    for chunk in chunks:
+        data = chunk.buffers()[2]
+        if data is not None and np.frombuffer(data, np.uint8).max(initial=0) >= 0x80:
+            return False
+    return True
+
+
+def _transform(a, kernel: str, method: str):
+    """Run a string-to-string pyarrow.compute kernel, or .str method.
+
+    Arrow-backed columns go straight to the kernel, skipping the .str
+    accessor; the result keeps the input's dtype, index and name. ASCII-only
+    data uses the ascii_* variant of a utf8_* kernel, which skips Unicode
+    case and whitespace tables.
+    """
+    a = _to_arrow_str(a)
+    if not _is_arrow_str(a):
+        return getattr(a.str, method)()
+    arr = pa.array(a)
+    if kernel.startswith("utf8_") and _is_ascii(arr):
+        kernel = "ascii_" + kernel[len("utf8_"):]
+    return _like(a, getattr(pc, kernel)(arr))
+
+
+def _like(a: pd.Series, result) -> pd.Series:
+    """Wrap an Arrow string result like the Arrow-backed column it came from."""
+    return pd.Series(pd.array(result, dtype=a.dtype), index=a.index, name=a.name)
+
+
+@on_unique
+def _upper(a):
+    return _transform(a, "utf8_upper", "upper")
+
+
+@on_unique
+def _lower(a):
+    return _transform(a, "utf8_lower", "lower")
+
+
+@on_unique
+def _strip(a):
+    return _transform(a, "utf8_trim_whitespace", "strip")
+
+
+@on_unique
+def _lstrip(a):
+    return _transform(a, "utf8_ltrim_whitespace", "lstrip")
+
+
+@on_unique
+def _rstrip(a):
+    return _transform(a, "utf8_rtrim_whitespace", "rstrip")
+
+
+@on_unique
+def _slice(a, start, end):
+    a = _to_arrow_str(a)
+    if not _is_arrow_str(a):
+        return a.str.slice(start, end)
+    return _like(a, pc.utf8_slice_codeunits(pa.array(a), start or 0, end))
+
+
+@on_unique
+def _str_len(a):
+    """Count characters; Arrow-backed columns give int32 read off the offsets.
+
+    Missing strings give NaN (float64) or <NA> (Int32), depending on the
+    column's missing-value semantics.
+    """
+    a = _to_arrow_str(a)
+    if not _is_arrow_str(a):
+        return a.str.len()
+    lengths = pc.cast(pc.utf8_length(pa.array(a)), pa.int32())
+    if a.dtype.na_value is pd.NA:
+        values = pd.array(lengths, dtype="Int32")
+    elif lengths.null_count:
+        values = lengths.to_numpy(zero_copy_only=False).astype(np.float64)
+    else:
+        values = lengths.to_numpy()
+    return pd.Series(values, index=a.index, name=a.name)
+
+
+def _arrow_strings(a):
+    """Convert a concat operand to an Arrow large_string array or scalar.
+
+    Integer columns are cast by Arrow directly, without a Python str per
+    row; other non-string columns are formatted with astype(str) first,
+    exactly like the pure pandas implementation (e.g. floats keep '1.0').
+    """
+    if not isinstance(a, pd.Series):
+        return pa.scalar(None if a is None else str(a), pa.large_string())
+    if not _is_arrow_str(a) and not pd.api.types.is_integer_dtype(a.dtype):
+        a = a.astype(str)
+    return pc.cast(pa.array(a), pa.large_string())
+
+
+def _concat(*parts, sep=""):
+    """Join values element-wise into one string column.
+
+    With pyarrow this is a single binary_join_element_wise kernel that sizes
+    and fills one output buffer, instead of materializing a Python str per
+    row per operand and adding them pairwise. Missing values stay missing.
+    """
+    index = next((p.index for p in parts if isinstance(p, pd.Series)), None)
+    if (
+        pa is None
+        or index is None
+        or any(isinstance(p, np.ndarray) for p in parts)
+        or any(isinstance(p, pd.Series) and not p.index.equals(index) for p in parts)
+    ):
+        strings = [p.astype(str) if hasattr(p, "astype") else str(p) for p in parts]
+        strings[1:] = [sep + s for s in strings[1:]]
+        return functools.reduce(operator.add, strings)
+
+    joined = pc.binary_join_element_wise(
+        *map(_arrow_strings, parts), pa.scalar(sep, pa.large_string())
     )
-    registry.register(
-        "replace",
-        lambda a, old, new: a.str.replace(old, new, regex=False),
-        "Replace: @replace(a, 'old', 'new')"
+    return pd.Series(
+        pd.array(joined, dtype=pd.StringDtype("pyarrow", na_value=np.nan)),
+        index=index,
     )
-    registry.register(
-        "slice",
-        lambda a, start, end: a.str.slice(start, end),
-        "Slice string: @slice(a, 0, 5)"
+
+
+def _mask(a: pd.Series, result) -> pd.Series:
+    """Wrap a boolean result like .str predicates with na=False do.
+
+    result is an Arrow boolean array (nulls count as False) or an ndarray.
+    The Series stays Arrow-backed (bool[pyarrow]), one bit per row instead
+    of NumPy's one byte, and works anywhere a NumPy bool mask does. Nulls
+    are read off the validity bitmap: fill_null runs only if there are any.
+    """
+    if isinstance(result, np.ndarray):
+        result = pa.array(result, pa.bool_())
+    if result.null_count:
+        result = pc.fill_null(result, False)
+    return pd.Series(
+        pd.array(result, dtype=pd.ArrowDtype(pa.bool_())), index=a.index, name=a.name
     )
+
+
+@on_unique
+def _startswith(a, prefix):
+    a = _to_arrow_str(a)
+    if not _is_arrow_str(a) or not isinstance(prefix, str):
+        return a.str.startswith(prefix, na=False)
+    arr = pa.array(a)
+    result = _numba_kernels.match_affix(arr, prefix)
+    return _mask(a, pc.starts_with(arr, pattern=prefix) if result is None else result)
+
+
+@on_unique
+def _endswith(a, suffix):
+    a = _to_arrow_str(a)
+    if not _is_arrow_str(a) or not isinstance(suffix, str):
+        return a.str.endswith(suffix, na=False)
+    arr = pa.array(a)
+    result = _numba_kernels.match_affix(arr, suffix, suffix=True)
+    return _mask(a, pc.ends_with(arr, pattern=suffix) if result is None else result)
+
+
+@on_unique
+def _replace(a, old, new):
+    a = _to_arrow_str(a)
+    if not _is_arrow_str(a) or not old or not isinstance(new, str):
+        return a.str.replace(old, new, regex=False)
+    result = pc.replace_substring(pa.array(a), pattern=old, replacement=new)
+    return _like(a, result)
+
+
+def _concat_sep(a, b, sep):
+    return _concat(a, b, sep=sep)
+
+
+# Characters that give a pattern regex meaning; without them it is a plain substring
+_REGEX_METACHARACTERS = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+
+@functools.lru_cache(maxsize=128)
+def _contains_kernel(pattern: str) -> str | None:
+    """Pick the pyarrow.compute kernel for a @contains pattern, once per pattern.
+
+    Returns:
+        'match_substring' for plain substrings, 'match_substring_regex' for
+        regexes RE2 accepts, or None for Python-only regex syntax (such as
+        lookarounds), which pandas evaluates with the re module
+    """
+    if _REGEX_METACHARACTERS.search(pattern) is None:
+        return "match_substring"
+    try:
+        pc.match_substring_regex(pa.array([""]), pattern=pattern)
+    except pa.ArrowInvalid:
+        return None
+    return "match_substring_regex"
+
+
+@on_unique
+def _contains(a, pattern):
+    """Test for a pattern, skipping the regex engine for plain substrings.
+
+    On Arrow-backed strings a plain substring becomes a single substring
+    search kernel and a regex runs on RE2.
+    """
+    a = _to_arrow_str(a)
+    kernel = _contains_kernel(pattern) if _is_arrow_str(a) else None
+    if kernel is None:
+        regex = _REGEX_METACHARACTERS.search(pattern) is not None
+        return a.str.contains(pattern, regex=regex, na=False)
+    return _mask(a, getattr(pc, kernel)(pa.array(a), pattern=pattern))
+
+
+_STRING_FUNCS = {
+    "upper": (_upper, "Uppercase: @upper(a)"),
+    "lower": (_lower, "Lowercase: @lower(a)"),
+    "strip": (_strip, "Strip whitespace: @strip(a)"),
+    "lstrip": (_lstrip, "Left strip: @lstrip(a)"),
+    "rstrip": (_rstrip, "Right strip: @rstrip(a)"),
+    "concat": (_concat, "Concatenate: @concat(a, b)"),
+    "concat3": (_concat, "Concatenate 3: @concat3(a, b, c)"),
+    "concat_sep": (_concat_sep, "Concatenate with separator: @concat_sep(a, b, ' ')"),
+    "str_len": (_str_len, "String length: @str_len(a)"),
+    "contains": (_contains, "Contains pattern: @contains(a, 'pattern')"),
+    "startswith": (_startswith, "Starts with: @startswith(a, 'prefix')"),
+    "endswith": (_endswith, "Ends with: @endswith(a, 'suffix')"),
+    "replace": (_replace, "Replace: @replace(a, 'old', 'new')"),
+    "slice": (_slice, "Slice string: @slice(a, 0, 5)"),
+}
+
+
+def register_string_functions(registry: FunctionRegistry) -> None:
+    """Register string functions."""
+    registry.register_batch(_STRING_FUNCS)
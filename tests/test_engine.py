@@ -1,15 +1,21 @@
 """Tests for FormulaEngine."""
 
+import ast
+import operator
+import warnings
+
 import numpy as np
 import pandas as pd
 import pytest
 
-from pandas_formula import FormulaEngine
+from pandas_formula import FormulaEngine, compiler
+from pandas_formula.functions import _numba_kernels
+from pandas_formula.functions import string as string_functions
 
 
-@pytest.fixture
-def sample_df():
-    return pd.DataFrame(
+@pytest.fixture(scope="module")
+def _base_df():
+    df = pd.DataFrame(
         {
             "a": [1, 2, 3],
             "b": [4, 5, 6],
@@ -18,6 +24,16 @@ def sample_df():
             "price": [100.0, 200.0, None],
         }
     )
+    original = df.copy()
+    yield df
+    pd.testing.assert_frame_equal(df, original)
+
+
+@pytest.fixture
+def sample_df(_base_df):
+    # Shallow copy: shares the module's data, but tests that modify the frame
+    # (inplace=True, attrs, ...) cannot leak into other tests
+    return _base_df.copy(deep=False)
 
 
 @pytest.fixture
@@ -62,8 +78,40 @@ class TestLogical:
         result = engine.apply(sample_df, {"result": "@if_else(@gt(a, 1), 'yes', 'no')"})
         assert result["result"].tolist() == ["no", "yes", "yes"]
 
+    def test_select(self, engine, sample_df):
+        result = engine.apply(
+            sample_df, {"result": "@select([@gt(a, 2), @gt(a, 1)], ['x', 'y'], 'z')"}
+        )
+        assert result["result"].tolist() == ["z", "y", "x"]
+
+    def test_nested_if_else_fused(self, engine, sample_df):
+        formula = "@if_else(@gt(a, 2), 'x', @if_else(@gt(a, 1), 'y', 'z'))"
+        tree = compiler.fuse_conditionals(
+            compiler.parse_formula(formula), engine._is_where
+        )
+        assert ast.unparse(tree).startswith(f"{compiler.FUSED_SELECT}([")
+        result = engine.apply(sample_df, {"result": formula})
+        assert result["result"].tolist() == ["z", "y", "x"]
+
+    def test_nested_if_else_with_common_subexpression(self, engine, sample_df):
+        formula = "@if_else(@gt(a, 1), @mul(a, b), @if_else(@gt(@mul(a, b), 5), 1, 2))"
+        result = engine.apply(sample_df, {"result": formula})
+        assert result["result"].tolist() == [2, 10, 18]
+
+    def test_nested_if_else_truthy_condition(self, engine, sample_df):
+        result = engine.apply(
+            sample_df, {"result": "@if_else(@sub(a, 1), a, @if_else(@sub(b, 4), b, c))"}
+        )
+        assert result["result"].tolist() == [7, 2, 3]
+
 
 class TestString:
+    def test_at_sign_in_string_literal(self, engine, sample_df):
+        result = engine.apply(
+            sample_df, {"result": "@if_else(@eq(name, 'bob'), 'b@x', 'other')"}
+        )
+        assert result["result"].tolist() == ["other", "b@x", "other"]
+
     def test_upper(self, engine, sample_df):
         result = engine.apply(sample_df, {"result": "@upper(name)"})
         assert result["result"].tolist() == ["ALICE", "BOB", "CHARLIE"]
@@ -72,16 +120,238 @@ class TestString:
         result = engine.apply(sample_df, {"result": "@lower(name)"})
         assert result["result"].tolist() == ["alice", "bob", "charlie"]
 
+    @pytest.mark.parametrize(
+        "func, expected",
+        [("strip", "a b"), ("lstrip", "a b "), ("rstrip", " a b"), ("upper", " A B ")],
+    )
+    def test_transform(self, engine, func, expected):
+        df = pd.DataFrame({"s": [" a b ", None]})
+        result = engine.apply(df, {"result": f"@{func}(s)"})
+        assert result["result"][0] == expected
+        assert pd.isna(result["result"][1])
+
+    def test_slice(self, engine, sample_df):
+        result = engine.apply(
+            sample_df, {"r1": "@slice(name, 1, 3)", "r2": "@slice(name, -2, None)"}
+        )
+        assert result["r1"].tolist() == ["li", "ob", "ha"]
+        assert result["r2"].tolist() == ["ce", "ob", "ie"]
+
+    @pytest.mark.parametrize("dtype", ["str", "string", object])
+    def test_startswith_endswith(self, engine, dtype):
+        df = pd.DataFrame({"s": pd.Series(["ab", "ba", None], dtype=dtype)})
+        result = engine.apply(
+            df, {"starts": "@startswith(s, 'a')", "ends": "@endswith(s, 'a')"}
+        )
+        assert result["starts"].tolist() == [True, False, False]
+        assert result["ends"].tolist() == [False, True, False]
+
+    def test_predicates_are_arrow_bool(self, engine):
+        pa = pytest.importorskip("pyarrow")
+        df = pd.DataFrame({"s": pd.Series(["ab", "ba", None], dtype="str")})
+        result = engine.apply(
+            df,
+            {
+                "has_a": "@contains(s, 'a')",
+                "starts": "@startswith(s, 'a')",
+                "both": "@and_(has_a, @not_(@endswith(s, 'a')))",
+                "label": "@if_else(starts, 'x', @if_else(has_a, 'y', 'z'))",
+            },
+        )
+        assert result["has_a"].dtype == pd.ArrowDtype(pa.bool_())
+        assert result["both"].tolist() == [True, False, False]
+        assert result["label"].tolist() == ["x", "y", "z"]
+
+    def test_arithmetic_on_masks(self, engine, sample_df):
+        engine.register("weight", lambda m: m * 2.5, raw=True)
+        result = engine.apply(
+            sample_df,
+            {
+                "scaled": "@mul(@startswith(name, 'c'), 10)",
+                "mask": "@endswith(name, 'e')",
+                "count": "@sub(@add(mask, 0), @contains(name, 'b'))",
+                "weighted": "@weight(mask)",
+            },
+        )
+        assert result["scaled"].tolist() == [0, 0, 10]
+        assert result["count"].tolist() == [1, -1, 1]
+        assert result["weighted"].tolist() == [2.5, 0.0, 2.5]
+
+    def test_upper_ascii_and_unicode(self, engine):
+        df = pd.DataFrame({"s": ["abc", "héllo"]})
+        result = engine.apply(
+            df, {"all": "@upper(s)", "ascii": "@upper(@slice(s, 0, 1))"}
+        )
+        assert result["all"].tolist() == ["ABC", "HÉLLO"]
+        assert result["ascii"].tolist() == ["A", "H"]
+
+    def test_str_len(self, engine, sample_df):
+        pytest.importorskip("pyarrow")
+        result = engine.apply(sample_df, {"result": "@str_len(name)"})
+        assert result["result"].tolist() == [5, 3, 7]
+        assert result["result"].dtype == np.int32
+
+    def test_replace(self, engine, sample_df):
+        result = engine.apply(sample_df, {"result": "@replace(name, 'li', '.*')"})
+        assert result["result"].tolist() == ["a.*ce", "bob", "char.*e"]
+
+    def test_contains(self, engine, sample_df):
+        result = engine.apply(
+            sample_df,
+            {"literal": "@contains(name, 'li')", "regex": "@contains(name, '^b.b$')"},
+        )
+        assert result["literal"].tolist() == [True, False, True]
+        assert result["regex"].tolist() == [False, True, False]
+
+    def test_contains_python_only_regex(self, engine, sample_df):
+        result = engine.apply(sample_df, {"result": "@contains(name, 'l(?=i)')"})
+        assert result["result"].tolist() == [True, False, True]
+
+    def test_concat(self, engine, sample_df):
+        result = engine.apply(
+            sample_df,
+            {
+                "r1": "@concat(name, a)",
+                "r2": "@concat3(name, '-', price)",
+                "r3": "@concat_sep(a, b, '-')",
+            },
+        )
+        assert result["r1"].tolist() == ["alice1", "bob2", "charlie3"]
+        assert result["r3"].tolist() == ["1-4", "2-5", "3-6"]
+        assert result["r2"].tolist()[:2] == ["alice-100.0", "bob-200.0"]
+        assert pd.isna(result["r2"][2])
+
+    def test_concat_without_pyarrow(self, engine, sample_df, monkeypatch):
+        monkeypatch.setattr(string_functions, "pa", None)
+        monkeypatch.setattr(string_functions, "pc", None)
+        result = engine.apply(
+            sample_df, {"r1": "@concat3(name, '-', price)", "r2": "@concat('#', a)"}
+        )
+        assert result["r1"].tolist()[:2] == ["alice-100.0", "bob-200.0"]
+        assert pd.isna(result["r1"][2])
+        assert result["r2"].tolist() == ["#1", "#2", "#3"]
+
+    def test_concat_sep(self, engine):
+        df = pd.DataFrame({"first": ["Ann", "Bo", None], "last": ["Lee", "Li", "Ma"]})
+        result = engine.apply(df, {"full": "@concat_sep(first, last, ' ')"})
+        assert result["full"].tolist()[:2] == ["Ann Lee", "Bo Li"]
+        assert pd.isna(result["full"][2])
+
+    def test_object_column_moved_to_arrow(self, engine):
+        pytest.importorskip("pyarrow")
+        df = pd.DataFrame({"name": pd.Series(["Ann", None, "bo"], dtype=object)})
+        result = engine.apply(df, {"upper": "@upper(name)", "len": "@str_len(name)"})
+        assert result["upper"].dtype.storage == "pyarrow"
+        assert result["upper"].tolist()[::2] == ["ANN", "BO"]
+        assert result["len"].tolist()[::2] == [3, 2]
+        assert df["name"].dtype == object
+
+    def test_conversion_cached_within_apply(self):
+        pa = pytest.importorskip("pyarrow")
+        df = pd.DataFrame({"s": pd.Series(["a", "b"], dtype=object)})
+
+        def data_address(s):
+            return pa.array(string_functions._to_arrow_str(s)).buffers()[2].address
+
+        with string_functions.conversion_cache():
+            first, second = data_address(df["s"]), data_address(df["s"])
+        assert first == second
+
+    def test_parallel_string_formulas(self):
+        df = pd.DataFrame({"s": pd.Series(["ab", "cd"], dtype=object)})
+        result = FormulaEngine(max_workers=2).apply(
+            df, {"u": "@upper(s)", "l": "@str_len(s)"}
+        )
+        assert result["u"].tolist() == ["AB", "CD"]
+        assert result["l"].tolist() == [2, 2]
+
+    def test_low_cardinality_object_column(self, engine):
+        values = ["x", "yy", np.nan, "x", "yy", "x"]
+        df = pd.DataFrame({"s": pd.Series(values, index=range(5, 11), dtype=object)})
+        result = engine.apply(df, {"upper": "@upper(s)", "hit": "@contains(s, 'y')"})
+        assert result["upper"].tolist()[3:] == ["X", "YY", "X"]
+        assert pd.isna(result["upper"][7])
+        assert result["hit"].tolist() == [False, True, False, False, True, False]
+
+    def test_mixed_object_column_not_converted(self, engine):
+        df = pd.DataFrame({"value": pd.Series(["a", 1], dtype=object)})
+        result = engine.apply(df, {"result": "@upper(value)"})
+        assert result["result"][0] == "A"
+        assert pd.isna(result["result"][1])
+
 
 class TestNull:
+    def test_arrow_backed_null_functions(self, engine):
+        pyarrow = pytest.importorskip("pyarrow")
+        df = pd.DataFrame(
+            {
+                "s": pd.Series(["a", None, "c"], dtype="string[pyarrow]"),
+                "t": pd.Series(["x", "y", None], dtype="string[pyarrow]"),
+            }
+        )
+        result = engine.apply(
+            df,
+            {
+                "null": "@isnull(s)",
+                "valid": "@notnull(s)",
+                "filled": "@coalesce(s, 'z')",
+                "merged": "@coalesce(s, t)",
+            },
+        )
+        assert result["null"].tolist() == [False, True, False]
+        assert result["valid"].tolist() == [True, False, True]
+        assert result["filled"].tolist() == ["a", "z", "c"]
+        assert result["merged"].tolist() == ["a", "y", "c"]
+        assert result["filled"].dtype == df["s"].dtype
+        assert result["null"].dtype == pd.ArrowDtype(pyarrow.bool_())
+
     def test_coalesce(self, engine, sample_df):
         result = engine.apply(sample_df, {"result": "@coalesce(price, 0)"})
         assert result["result"].tolist() == [100.0, 200.0, 0.0]
 
+    def test_coalesce_from_column(self, engine, sample_df):
+        result = engine.apply(sample_df, {"result": "@coalesce(price, a)"})
+        assert result["result"].tolist() == [100.0, 200.0, 3.0]
+
+    def test_fillna_int_column_unchanged(self, engine, sample_df):
+        result = engine.apply(sample_df, {"result": "@fillna(a, 0)"})
+        assert result["result"].tolist() == [1, 2, 3]
+
+    def test_fillna_string_column(self, engine):
+        df = pd.DataFrame({"name": ["alice", None]})
+        result = engine.apply(df, {"result": "@fillna(name, 'n/a')"})
+        assert result["result"].tolist() == ["alice", "n/a"]
+
     def test_isnull(self, engine, sample_df):
         result = engine.apply(sample_df, {"result": "@isnull(price)"})
         assert result["result"].tolist() == [False, False, True]
 
+    def test_fillna_nullable_int_keeps_dtype(self, engine):
+        df = pd.DataFrame({"n": pd.array([1, None, 3], dtype="Int64")})
+        result = engine.apply(df, {"c": "@coalesce(n, 0)", "f": "@fillna(n, 0)"})
+        assert result["c"].dtype == result["f"].dtype == "Int64"
+        assert result["c"].tolist() == [1, 0, 3]
+
+    def test_coalesce_series_feeds_series_function(self, engine, sample_df):
+        result = engine.apply(sample_df, {"result": "@isnull(@coalesce(price, 0))"})
+        assert result["result"].tolist() == [False, False, False]
+
+
+class TestMath:
+    def test_categorize(self, engine, sample_df):
+        result = engine.apply(
+            sample_df,
+            {"result": "@categorize(a, [0, 2, 10], ['low', 'high'], right=False)"},
+        )
+        assert isinstance(result["result"].dtype, pd.CategoricalDtype)
+        assert result["result"].tolist() == ["low", "high", "high"]
+
+    def test_categorize_open_ended_bins(self, engine):
+        df = pd.DataFrame({"score": [-5, 59, 60, 95, 120]})
+        formula = "@categorize(score, [-inf, 60, 90, inf], ['F', 'C', 'A'], right=False)"
+        result = engine.apply(df, {"grade": formula})
+        assert result["grade"].tolist() == ["F", "F", "C", "A", "A"]
+
 
 class TestCustomFunction:
     def test_register(self, engine, sample_df):
@@ -94,6 +364,71 @@ class TestCustomFunction:
         result = engine.apply(sample_df, {"result": "@weighted(a, b, 0.5)"})
         assert result["result"].tolist() == [2.5, 3.5, 4.5]
 
+    def test_raw_function_receives_arrays(self, engine, sample_df):
+        seen = []
+        engine.register("spy", lambda x, y: seen.append((type(x), type(y))) or x, raw=True)
+        engine.apply(sample_df, {"result": "@spy(a, name)"})
+        assert seen == [(np.ndarray, pd.Series)]
+
+    def test_non_raw_function_receives_series(self, engine, sample_df):
+        seen = []
+        engine.register("spy", lambda x: seen.append(type(x)) or x)
+        engine.apply(sample_df, {"result": "@add(@spy(a), 1)"})
+        assert seen == [pd.Series]
+
+    @pytest.mark.parametrize(
+        "formula, expected",
+        [
+            ("a.shift(1)", [None, 1.0, 2.0]),
+            ("price.fillna(0)", [100.0, 200.0, 0.0]),
+            ("price.isna()", [False, False, True]),
+            ("a.rolling(2).sum()", [None, 3.0, 5.0]),
+            ("@mul(price, 2).fillna(0)", [200.0, 400.0, 0.0]),
+        ],
+    )
+    def test_series_methods_keep_series(self, engine, sample_df, formula, expected):
+        result = engine.apply(sample_df, {"result": formula})
+        pd.testing.assert_series_equal(
+            result["result"], pd.Series(expected, name="result"), check_dtype=False
+        )
+
+    def test_raw_divide_by_zero_is_silent(self, engine, sample_df):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            result = engine.apply(sample_df, {"result": "@div(a, 0)"})
+        assert result["result"].tolist() == [np.inf, np.inf, np.inf]
+
+    def test_reregister_after_apply(self, engine, sample_df):
+        engine.register("scale", lambda x: x * 3)
+        engine.apply(sample_df, {"result": "@scale(a)"})
+        engine.registry.register("scale", lambda x: x * 10)
+        result = engine.apply(sample_df, {"result": "@scale(a)"})
+        assert result["result"].tolist() == [10, 20, 30]
+
+    def test_unregistered_after_apply(self, engine, sample_df):
+        engine.register("scale", lambda x: x * 3)
+        engine.apply(sample_df, {"result": "@scale(a)"})
+        engine.registry.unregister("scale")
+        with pytest.raises(ValueError, match="not registered"):
+            engine.apply(sample_df, {"result": "@scale(a)"})
+
+    def test_registry_as_dict(self, engine):
+        functions = engine._registry.as_dict()
+        assert functions is engine._registry.as_dict()
+        assert "add" in functions and "_function_docs" not in functions
+        with pytest.raises(TypeError):
+            functions["add"] = None
+        engine.register("triple", lambda x: x * 3)
+        assert "triple" in engine._registry.as_dict()
+
+    def test_list_functions_sorted(self, engine):
+        engine.register("aaa", lambda x: x)
+        functions = engine.list_functions()
+        assert functions == sorted(functions)
+        assert "aaa" in functions
+        assert "register" not in functions
+        assert not engine._registry.has("register")
+
 
 class TestRegisterBatch:
     def test_batch_with_functions(self, engine, sample_df):
@@ -131,6 +466,14 @@ class TestRegisterBatch:
         assert result["r1"].tolist() == [2, 4, 6]
         assert result["r2"].tolist() == [3, 6, 9]
 
+    def test_registry_batch_bumps_version_once(self, engine):
+        registry = engine.registry
+        version = registry.version
+        registry.register_batch({"one": lambda x: x, "two": (lambda x: x, "Two")})
+        assert registry.version == version + 1
+        assert registry.get_doc("two") == "Two"
+        assert {"one", "two"} <= set(registry.as_dict())
+
     def test_batch_empty(self, engine):
         ret = engine.register_batch({})
         assert ret is engine
@@ -147,6 +490,153 @@ class TestChaining:
         )
         assert result["step2"].tolist() == [6, 9, 12]
 
+    def test_intermediate_not_in_outputs(self, engine, sample_df):
+        result = engine.apply(
+            sample_df,
+            {
+                "step1": "@mul(a, 2)",
+                "step2": "@add(step1, b)",
+                "label": "@upper(name)",
+            },
+            outputs=["step2"],
+        )
+        assert "step1" not in result.columns
+        assert "label" not in result.columns
+        assert result["step2"].tolist() == [6, 9, 12]
+
+    def test_intermediate_feeding_non_operator_formula(self, engine, sample_df):
+        result = engine.apply(
+            sample_df,
+            {"step1": "@mul(a, 2)", "step2": "@round(@div(step1, 4), 1)"},
+            outputs=["step2"],
+        )
+        assert "step1" not in result.columns
+        assert result["step2"].tolist() == [0.5, 1.0, 1.5]
+
+    def test_intermediate_feeding_series_functions(self, engine, sample_df):
+        result = engine.apply(
+            sample_df,
+            {
+                "s": "@mul(a, 2)",
+                "std": "@std(s)",
+                "median": "@median(s)",
+                "count": "@count(s)",
+                "null": "@isnull(s)",
+                "kept": "@dropna(s)",
+                "total": "@sum(a)",
+                "share": "@div(a, total)",
+                "total_std": "@std(total)",
+            },
+            outputs=["std", "median", "count", "null", "kept", "share", "total_std"],
+        )
+        assert result["std"].tolist() == [2.0] * 3
+        assert result["median"].tolist() == [4.0] * 3
+        assert result["count"].tolist() == [3] * 3
+        assert result["null"].tolist() == [False] * 3
+        assert result["kept"].tolist() == [2, 4, 6]
+        assert result["share"].tolist() == [1 / 6, 2 / 6, 3 / 6]
+        assert result["total_std"].tolist() == [0.0] * 3
+
+    def test_shorter_series_aligned_to_frame(self, engine, sample_df):
+        result = engine.apply(
+            sample_df,
+            {"kept": "@dropna(price)", "x": "@add(kept, a)", "y": "@mul(kept, 2)"},
+        )
+        np.testing.assert_array_equal(result["kept"], [100.0, 200.0, np.nan])
+        np.testing.assert_array_equal(result["x"], [101.0, 202.0, np.nan])
+        np.testing.assert_array_equal(result["y"], [200.0, 400.0, np.nan])
+
+    def test_plan_fuses_transient_arithmetic(self, engine):
+        plan = engine._plan(
+            {"step1": "@mul(a, 2)", "step2": "@add(step1, b)"}, {"step2"}
+        )
+        assert plan == [("step2", "__pf_add(__pf_mul(a, 2), b)")]
+        assert engine._plan({"x": "@add(a, b)"}, {"x"}) == [("x", "@add(a, b)")]
+
+    def test_expansion_cached_across_applies(self, engine, sample_df, monkeypatch):
+        calls = []
+        to_numexpr = compiler.to_numexpr
+
+        def spy(formula, resolve):
+            calls.append(formula)
+            return to_numexpr(formula, resolve)
+
+        monkeypatch.setattr(compiler, "to_numexpr", spy)
+        formulas = {"step1": "@mul(a, 2)", "step2": "@add(step1, b)"}
+        for _ in range(3):
+            engine.apply(sample_df, formulas)
+        assert sorted(calls) == sorted(formulas.values())
+        engine.register("twice", lambda x: x * 2)
+        engine.apply(sample_df, formulas)
+        assert len(calls) == 4
+
+    def test_fusion_respects_redefined_columns(self, engine, sample_df):
+        result = engine.apply(
+            sample_df,
+            {"step1": "@mul(a, 2)", "a": "@neg(a)", "step2": "@add(step1, a)"},
+            outputs=["step2"],
+        )
+        assert result["step2"].tolist() == [1, 2, 3]
+
+    def test_unknown_output(self, engine, sample_df):
+        with pytest.raises(ValueError, match="No formula"):
+            engine.apply(sample_df, {"step1": "@mul(a, 2)"}, outputs=["nope"])
+
+    def test_syntax_error_reported_for_column(self, engine, sample_df):
+        with pytest.raises(ValueError, match="Failed to evaluate formula for 'r'"):
+            engine.apply(sample_df, {"ok": "@mul(a, 2)", "r": "@add(a,"})
+
+
+class TestInplace:
+    def test_input_untouched(self, engine, sample_df):
+        original = sample_df.copy()
+        result = engine.apply(sample_df, {"a": "@mul(a, 10)", "new": "@add(a, b)"})
+        pd.testing.assert_frame_equal(sample_df, original)
+        assert result["a"].tolist() == [10, 20, 30]
+
+    def test_inplace(self, engine, sample_df):
+        result = engine.apply(sample_df, {"new": "@add(a, b)"}, inplace=True)
+        assert result is sample_df
+        assert sample_df["new"].tolist() == [5, 7, 9]
+
+    def test_batch_assignment(self, engine, sample_df):
+        sample_df.attrs["source"] = "test"
+        result = engine.apply(
+            sample_df, {"x": "@add(a, b)", "b": "@mul(b, 2)", "y": "1.5"}
+        )
+        assert list(result.columns) == [*sample_df.columns, "x", "y"]
+        assert result["b"].tolist() == [8, 10, 12]
+        assert result["y"].tolist() == [1.5, 1.5, 1.5]
+        assert result.attrs == {"source": "test"}
+
+
+class TestParallel:
+    def test_matches_serial(self, engine, sample_df):
+        formulas = {
+            "x": "@add(a, b)",
+            "y": "@mul(a, c)",
+            "z": "@sub(x, y)",
+            "w": "@div(z, b)",
+        }
+        parallel = FormulaEngine(max_workers=4).apply(sample_df, formulas)
+        pd.testing.assert_frame_equal(parallel, engine.apply(sample_df, formulas))
+        assert list(parallel.columns)[-4:] == ["x", "y", "z", "w"]
+
+    def test_overwrite_after_read(self, sample_df):
+        engine = FormulaEngine(max_workers=4)
+        result = engine.apply(sample_df, {"x": "@add(a, 1)", "a": "@mul(b, 2)"})
+        assert result["x"].tolist() == [2, 3, 4]
+        assert result["a"].tolist() == [8, 10, 12]
+
+    def test_levels(self):
+        steps = [("x", "a + 1"), ("y", "b"), ("z", "x + y"), ("a", "z")]
+        levels = FormulaEngine._levels(steps)
+        assert [[column for column, _ in level] for level in levels] == [
+            ["x", "y"],
+            ["z"],
+            ["a"],
+        ]
+
 
 class TestValidation:
     def test_validate_success(self, engine, sample_df):
@@ -158,6 +648,27 @@ class TestValidation:
         assert len(errors) == 1
         assert "result" in errors[0]
 
+    def test_validate_unknown_function(self, engine, sample_df):
+        errors = engine.validate(sample_df, {"result": "@nope(a)"})
+        assert errors == ["result: unknown function(s): @nope"]
+
+    def test_validate_syntax_error(self, engine, sample_df):
+        errors = engine.validate(sample_df, {"result": "@add(a,"})
+        assert len(errors) == 1
+        assert errors[0].startswith("result: invalid syntax")
+
+    def test_validate_chained_columns(self, engine, sample_df):
+        errors = engine.validate(
+            sample_df, {"step1": "@mul(a, 2)", "step2": "@add(step1, b)"}
+        )
+        assert errors == []
+
+    def test_validate_does_not_evaluate(self, engine, sample_df):
+        calls = []
+        engine.register("spy", lambda x: calls.append(x) or x)
+        assert engine.validate(sample_df, {"result": "@spy(a)"}) == []
+        assert calls == []
+
 
 class TestExtractReferences:
     def test_single_function_single_arg(self, engine):
@@ -202,6 +713,13 @@ class TestExtractReferences:
     def test_bare_identifier(self, engine):
         assert engine.extract_references("timestamps") == {"timestamps"}
 
+    def test_operator_syntax(self, engine):
+        assert engine.extract_references("a == b") == {"a", "b"}
+
+    def test_invalid_syntax(self, engine):
+        with pytest.raises(SyntaxError):
+            engine.extract_references("@add(a,")
+
     def test_batch(self, engine):
         refs = engine.extract_references_batch(
             {
@@ -211,6 +729,11 @@ class TestExtractReferences:
         )
         assert refs == {"arg1", "arg2"}
 
+    def test_cached_result_not_shared(self):
+        refs = FormulaEngine.extract_references("@add(a, b)")
+        refs.add("c")
+        assert FormulaEngine.extract_references("@add(a, b)") == {"a", "b"}
+
 
 class TestFromDict:
     def test_from_dict(self, sample_df):
@@ -224,3 +747,268 @@ class TestFromDict:
         result = engine.apply(sample_df)
         assert result["sum"].tolist() == [5, 7, 9]
         assert result["product"].tolist() == [4, 10, 18]
+
+    def test_from_dict_constants(self, sample_df):
+        config = {
+            "constants": {"rate": 10},
+            "columns": {"scaled": "@mul(a, @rate())"},
+        }
+        engine = FormulaEngine.from_dict(config)
+        assert engine.apply(sample_df)["scaled"].tolist() == [10, 20, 30]
+        assert engine.to_dict()["constants"] == {"rate": 10}
+
+
+class TestConstants:
+    def test_constant_forms(self, engine, sample_df):
+        engine.add_constant("rate", 2)
+        result = engine.apply(
+            sample_df,
+            {"r1": "@mul(a, @rate())", "r2": "@mul(a, @rate)", "r3": "@mul(a, rate)"},
+        )
+        assert result["r1"].tolist() == result["r2"].tolist() == [2, 4, 6]
+        assert result["r3"].tolist() == [2, 4, 6]
+        assert not engine.registry.has("rate")
+
+    def test_column_shadows_bare_constant(self, engine, sample_df):
+        engine.add_constant("a", 100)
+        result = engine.apply(sample_df, {"r1": "@add(a, 1)", "r2": "@add(@a, 1)"})
+        assert result["r1"].tolist() == [2, 3, 4]
+        assert result["r2"].tolist() == [101, 101, 101]
+
+    def test_constant_change_recompiles(self, engine, sample_df):
+        engine.add_constant("rate", 2)
+        engine.apply(sample_df, {"r": "@mul(a, @rate())"})
+        engine.add_constant("rate", 3)
+        result = engine.apply(sample_df, {"r": "@mul(a, @rate())"})
+        assert result["r"].tolist() == [3, 6, 9]
+
+    def test_validate_knows_constants(self, engine, sample_df):
+        engine.add_constant("rate", 2)
+        errors = engine.validate(sample_df, {"r": "@add(@mul(a, @rate()), rate)"})
+        assert errors == []
+
+
+class TestCompile:
+    def test_column_shadowing_function_name(self, engine):
+        df = pd.DataFrame({"count": [1, 2, 3]})
+        result = engine.apply(df, {"result": "@add(count, @count(count))"})
+        assert result["result"].tolist() == [4, 5, 6]
+
+    def test_repeated_apply_reuses_compiled_formula(self, engine, sample_df):
+        first = engine.apply(sample_df, {"result": "@add(a, b)"})
+        second = engine.apply(sample_df, {"result": "@add(a, b)"})
+        assert first["result"].tolist() == second["result"].tolist() == [5, 7, 9]
+
+    @pytest.mark.parametrize(
+        "formula, expected",
+        [
+            ("a > 1 and b < 6", [False, True, False]),
+            ("a < 2 or b > 5", [True, False, True]),
+            ("1 < a < 3", [False, True, False]),
+            ("a in [1, 3]", [True, False, True]),
+            ("a not in [1, 3]", [False, True, False]),
+            ("not (a > 1)", [True, False, False]),
+            ("abs(@sub(a, 2))", [1, 0, 1]),
+            ("sqrt(abs(a))", [1.0, 2 ** 0.5, 3 ** 0.5]),
+            ("@gt(a, inf)", [False, False, False]),
+            ("@gt(a, -Inf)", [True, True, True]),
+            ("@clip(b, -inf, 5)", [4, 5, 5]),
+        ],
+    )
+    def test_pandas_eval_syntax(self, engine, sample_df, formula, expected):
+        result = engine.apply(sample_df, {"result": formula})
+        assert result["result"].tolist() == expected
+
+    def test_inf_is_not_a_column(self, engine, sample_df):
+        assert engine.extract_references("@gt(a, inf)") == {"a"}
+        assert engine.validate(sample_df, {"r": "@lt(-inf, Inf)"}) == []
+
+    def test_backtick_column_names(self, engine):
+        df = pd.DataFrame({"my col": [1, 2, 3], "a": [1, 1, 1]})
+        formulas = {"result": "`my col` + a", "twice": "@mul(`my col`, 2)"}
+        result = engine.apply(df, formulas)
+        assert result["result"].tolist() == [2, 3, 4]
+        assert result["twice"].tolist() == [2, 4, 6]
+        assert engine.extract_references("`my col` + a") == {"my col", "a"}
+        assert engine.validate(df, formulas) == []
+
+
+class TestLiterals:
+    def test_literal_shortcut(self, engine, sample_df):
+        assert compiler.literal(" 3.14 ") == (3.14,)
+        assert compiler.literal("'a@b'") == ("a@b",)
+        assert compiler.literal("None") == (None,)
+        assert compiler.literal("[1, 2]") is None
+        assert compiler.literal("@add(a, 1)") is None
+        result = engine.apply(sample_df, {"pi": "3.14", "label": "'x'"})
+        assert result["pi"].tolist() == [3.14] * 3
+        assert result["label"].tolist() == ["x"] * 3
+
+    def test_literal_feeds_later_formulas(self, engine, sample_df):
+        result = engine.apply(
+            sample_df,
+            {
+                "k": "'x'",
+                "n": "5",
+                "upper": "@upper(k)",
+                "null": "@isnull(k)",
+                "total": "@sum(n)",
+                "scaled": "@mul(a, n)",
+            },
+        )
+        assert result["upper"].tolist() == ["X"] * 3
+        assert result["null"].tolist() == [False] * 3
+        assert result["total"].tolist() == [15] * 3
+        assert result["scaled"].tolist() == [5, 10, 15]
+
+
+class TestCommonSubexpressions:
+    def test_rewrites_repeated_operator_calls(self, engine):
+        tree = compiler.eliminate_common_subexpressions(
+            compiler.parse_formula("@div(@sub(@mul(a, b), c), @mul(a, b))"),
+            engine._is_pure,
+        )
+        assert ast.unparse(tree) == (
+            "__pf_div(__pf_sub((__cse0 := __pf_mul(a, b)), c), __cse0)"
+        )
+
+    def test_margin(self, engine, sample_df):
+        result = engine.apply(
+            sample_df, {"result": "@div(@sub(@mul(a, b), c), @mul(a, b))"}
+        )
+        np.testing.assert_allclose(result["result"], [-3 / 4, 2 / 10, 9 / 18])
+
+    def test_impure_calls_not_merged(self, engine, sample_df):
+        calls = []
+        engine.register("spy", lambda x: calls.append(1) or x)
+        result = engine.apply(sample_df, {"result": "@add(@spy(a), @spy(a))"})
+        assert result["result"].tolist() == [2, 4, 6]
+        assert len(calls) == 2
+
+
+class TestNumexpr:
+    @pytest.fixture(autouse=True)
+    def _force_numexpr(self, monkeypatch):
+        pytest.importorskip("numexpr")
+        monkeypatch.setattr(compiler, "NUMEXPR_MIN_ROWS", 0)
+
+    def test_to_numexpr_expands_operators(self, engine):
+        expression = compiler.to_numexpr(
+            "@mul(@add(a, b), c)", engine.registry.get
+        )
+        assert expression == "(a + b) * c"
+
+    def test_to_numexpr_rejects_other_functions(self, engine):
+        assert compiler.to_numexpr("@round(a, 1)", engine.registry.get) is None
+
+    def test_arithmetic(self, engine, sample_df):
+        result = engine.apply(sample_df, {"result": "@div(@add(a, b), c)"})
+        np.testing.assert_allclose(result["result"], [5 / 7, 7 / 8, 9 / 9])
+
+    def test_comparison_and_logic(self, engine, sample_df):
+        result = engine.apply(
+            sample_df, {"result": "@and_(@gt(a, 1), @not_(@eq(b, 6)))"}
+        )
+        assert result["result"].tolist() == [False, True, False]
+
+    def test_pandas_eval_syntax(self, engine):
+        df = pd.DataFrame({"my col": [1.0, 2.0, 3.0], "a": [1, 2, 3]})
+        result = engine.apply(
+            df,
+            {
+                "doubled": "`my col` * 2",
+                "result": "not (doubled > 2) or 1 < a < 3",
+            },
+            outputs=["result"],
+        )
+        assert result["result"].tolist() == [True, True, False]
+
+    def test_bypasses_pandas_eval(self, engine, sample_df, monkeypatch):
+        def fail(*args, **kwargs):
+            raise AssertionError("pandas eval should not be used")
+
+        monkeypatch.setattr(pd, "eval", fail)
+        monkeypatch.setattr(pd.DataFrame, "eval", fail)
+        result = engine.apply(sample_df, {"result": "@sub(@mul(a, c), b)"})
+        assert result["result"].tolist() == [3, 11, 21]
+
+    def test_overridden_operator_not_expanded(self, engine, sample_df):
+        engine.register("add", lambda a, b: a * 10 + b)
+        result = engine.apply(sample_df, {"result": "@add(a, b)"})
+        assert result["result"].tolist() == [14, 25, 36]
+
+    def test_narrow_dtypes_keep_numpy_result_dtype(self, engine):
+        df = pd.DataFrame(
+            {
+                "f": np.array([1.0, 2.0], dtype=np.float32),
+                "i": np.array([1, 2], dtype=np.int8),
+            }
+        )
+        result = engine.apply(df, {"scaled": "@mul(f, 0.5)", "total": "@add(i, i)"})
+        assert result["scaled"].dtype == np.float32
+        assert result["total"].dtype == np.int8
+
+    def test_string_columns_use_python_path(self, engine, sample_df):
+        result = engine.apply(sample_df, {"result": "@eq(name, 'bob')"})
+        assert result["result"].tolist() == [False, True, False]
+
+
+class TestNumba:
+    @pytest.fixture(autouse=True)
+    def _force_numba(self, monkeypatch):
+        pytest.importorskip("numba")
+        monkeypatch.setattr(_numba_kernels, "MIN_SIZE", 0)
+        monkeypatch.setattr(_numba_kernels, "MIN_STRINGS", 0)
+
+    @pytest.fixture
+    def kernels(self, monkeypatch):
+        launched = []
+        kernel = _numba_kernels._kernel
+
+        def spy(op):
+            launched.append(op)
+            return kernel(op)
+
+        monkeypatch.setattr(_numba_kernels, "_kernel", spy)
+        return launched
+
+    def test_int_arithmetic_keeps_dtype(self, engine, sample_df, kernels):
+        result = engine.apply(sample_df, {"result": "@add(@mul(a, 2), b)"})
+        assert result["result"].dtype == np.int64
+        assert result["result"].tolist() == [6, 9, 12]
+        assert kernels == [operator.mul, operator.add]
+
+    def test_fused_chain_uses_kernels(self, engine, sample_df, kernels):
+        result = engine.apply(
+            sample_df,
+            {"step1": "@mul(a, 2)", "step2": "@add(step1, b)"},
+            outputs=["step2"],
+        )
+        assert result["step2"].tolist() == [6, 9, 12]
+        assert kernels == [operator.mul, operator.add]
+
+    def test_div_and_compare(self, engine, sample_df, kernels):
+        result = engine.apply(
+            sample_df, {"ratio": "@div(b, a)", "flag": "@gte(price, 200.0)"}
+        )
+        assert result["ratio"].tolist() == [4.0, 2.5, 2.0]
+        assert result["flag"].tolist() == [False, True, False]
+        assert kernels == [operator.truediv, operator.ge]
+
+    def test_mixed_dtypes_fall_back(self, engine, sample_df):
+        result = engine.apply(sample_df, {"result": "@add(a, 0.5)"})
+        assert result["result"].tolist() == [1.5, 2.5, 3.5]
+
+    def test_short_affix(self, engine):
+        pa = pytest.importorskip("pyarrow")
+        df = pd.DataFrame({"s": ["US-1", "CA-2", None, "U", "é-US"]})
+        arr = pa.array(df["s"])
+        assert _numba_kernels.match_affix(arr, "US").tolist() == [
+            True, False, False, False, False
+        ]
+        assert _numba_kernels.match_affix(arr, "x" * 9) is None
+        result = engine.apply(
+            df, {"starts": "@startswith(s, 'é')", "ends": "@endswith(s, 'US')"}
+        )
+        assert result["starts"].tolist() == [False, False, False, False, True]
+        assert result["ends"].tolist() == [False, False, False, False, True]